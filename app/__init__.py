@@ -1,6 +1,16 @@
 import os
+import json
 import webbrowser
 
+from .packages.odata import ODataQuery
+from .packages.stages import StageCache
+from .packages.matrix import DistanceMatrix
+from .packages.spatial import SpatialIndex
+from .packages.distance import Haversine
+from .packages.parallel import WorkerPool
+from .packages.geocache import GeocodeCache
+from .packages.clustertable import ClusterTable
+from .packages.artifacts import Artifacts
 from .packages.mapping import MappingEngine
 from .packages.geocode import LocationEngine
 from .packages.clustering import ClusterEngine
@@ -13,26 +23,107 @@ static_dir = os.path.abspath(__file__).replace('__init__.py', 'static/')
 
 class ControlFlow():
 
+    stages = ['download', 'geocode', 'cluster', 'map', 'export']
+
+    # Seconds a Cached Accounts Download is Reused (0 = Download on every Run)
+    download_max_age: float = 0
+
+    # Helper Modules the Cluster Stage's Output Depends on (editing them invalidates the Stage)
+    geometry = (Haversine.__module__, SpatialIndex.__module__, DistanceMatrix.__module__, ClusterTable.__module__, WorkerPool.__module__)
+
+    @property
+    def hulls(self) -> dict:
+        """ Territory hull settings shared by the map and export stages """
+
+        return {
+            'hull_method': MappingEngine.hull_method,
+            'concave_ratio': MappingEngine.concave_ratio,
+            'simplify_pixels': MappingEngine.simplify_pixels
+        }
+
     @staticmethod
     def mapview():
         webbrowser.open(static_dir + 'map.html')
 
-    def run(self):
-        accounts = DynamicsEngine.download()
-        log.debug('Saving Accounts Download...')
-        accounts.to_csv(static_dir + 'accounts.csv')
+    @staticmethod
+    def dump(index: dict, path: str) -> None:
+        with open(path, 'w') as file:
+            json.dump(index, file, indent=4)
+
+    def run(self, *, force: list = None):
+        """
+            Executes the download -> geocode -> cluster -> map / export pipeline, skipping unchanged stages
+
+            Args:
+                force: Stage names to re-run regardless of the stage cache (an empty list forces every stage)
+        """
 
+        force = self.stages if force == [] else (force or [])
 
-        coordinates = LocationEngine.geocode(accounts)
-        log.debug('Saving Geocoding Data...')
-        coordinates.to_csv(static_dir + 'coordinates.csv')
+        with log.span('pipeline', force=sorted(force)):
+            accounts = StageCache.run(
+                'download', DynamicsEngine.download,
+                artifact=Artifacts.path('accounts'), save=Artifacts.write, load=Artifacts.read,
+                params={
+                    'version': DynamicsEngine.version,
+                    'columns': DynamicsEngine.columns,
+                    'excluded_statuses': DynamicsEngine.excluded_statuses,
+                    'sync_mode': DynamicsEngine.sync_mode,
+                    'sync_columns': DynamicsEngine.sync_columns
+                },
+                sources=(DynamicsEngine.__module__, ODataQuery.__module__),
+                force='download' in force, max_age=self.download_max_age
+            )
 
-        clustered = ClusterEngine.cluster(stores=coordinates)
-        log.debug('Saving Cluster Algorithm Results...')
-        clustered.to_csv(static_dir + 'clusters.csv')
+            coordinates = StageCache.run(
+                'geocode', lambda: LocationEngine.geocode(accounts, changed=DynamicsEngine.changed),
+                artifact=Artifacts.path('coordinates'), save=Artifacts.write, load=Artifacts.read,
+                inputs=('download',),
+                params={'provider': type(LocationEngine.geocoder).__name__},
+                sources=(LocationEngine.__module__, GeocodeCache.__module__, Artifacts.__module__),
+                force='geocode' in force
+            )
 
-        map = MappingEngine.map()
+            clustered = StageCache.run(
+                'cluster', lambda: ClusterEngine.cluster(stores=coordinates),
+                artifact=Artifacts.path('clusters'), save=Artifacts.write, load=Artifacts.read,
+                inputs=('geocode',),
+                params={
+                    'radius_km': ClusterEngine.radius_km,
+                    'min_cluster_size': ClusterEngine.min_cluster_size,
+                    'max_cluster_size': ClusterEngine.max_cluster_size,
+                    'max_iterations': ClusterEngine.max_iterations,
+                    'tolerance_km': ClusterEngine.tolerance_km
+                },
+                sources=(ClusterEngine.__module__, *self.geometry),
+                force='cluster' in force
+            )
 
-        map.save(static_dir + 'map.html')
+            StageCache.run(
+                'map', lambda: MappingEngine.map(clustered),
+                artifact=static_dir + 'map.html', save=lambda map, path: map.save(path), load=lambda path: None,
+                inputs=('cluster',),
+                params={
+                    'map_center': MappingEngine.map_center,
+                    'render_mode': MappingEngine.render_mode,
+                    'cluster_zoom': MappingEngine.cluster_zoom,
+                    'show_hulls': MappingEngine.show_hulls,
+                    **self.hulls
+                },
+                sources=(MappingEngine.__module__, Artifacts.__module__),
+                force='map' in force
+            )
 
-        
+            StageCache.run(
+                'export', lambda: MappingEngine.export(clustered),
+                artifact=os.path.join(MappingEngine.exportdir, 'index.json'), save=self.dump, load=lambda path: None,
+                inputs=('cluster',),
+                params={
+                    'formats': MappingEngine.export_formats,
+                    'zooms': MappingEngine.tile_zooms,
+                    'precision': MappingEngine.precision,
+                    **self.hulls
+                },
+                sources=(MappingEngine.__module__, Artifacts.__module__),
+                force='export' in force
+            )
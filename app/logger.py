@@ -1,3 +1,12 @@
+import os
+import sys
+import json
+import time
+import queue
+import atexit
+import functools
+import threading
+
 from colorama import init
 from colorama import Fore
 from colorama import Style
@@ -5,6 +14,12 @@ from colorama import Style
 from os.path import abspath
 from datetime import datetime
 
+try:
+    import resource
+except ImportError:
+    # Not Available on Windows - Peak RSS is Omitted from Spans
+    resource = None
+
 
 def setup():
     init()
@@ -13,7 +28,9 @@ directory = abspath(__file__).replace('logger.py', 'logfiles/')
 
 class CustomLogger():
 
+    # Lowest Level Printed to the Console / Written to the Log Files
     threshold: int = 1
+    file_threshold: int = 1
 
     levels = [
         'TRACE',
@@ -33,26 +50,176 @@ class CustomLogger():
         Fore.RED
     ]
 
-    logfiles = { 
+    logfiles = {
         key: directory + key for key in ['events', 'errors']
     }
 
+    # Also Write every Message and Span as a JSON Object per Line to `structuredfile`
+    structured: bool = False
+    structuredfile = directory + 'events.jsonl'
+
+    # Pending File Writes (Callers Block only once the Queue is Full) and Lines Written per Flush
+    queue_size: int = 10000
+    batch_size: int = 500
+
+    # Seconds a Caller Waits on a Full Queue before Writing the Line Directly
+    put_timeout: float = 5
+
+    _queue: queue.Queue = None
+    _thread: threading.Thread = None
+    _pid: int = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def enabled(cls, level: int) -> bool:
+        """ Whether a message at `level` would be printed or written """
+
+        return level >= min(cls.threshold, cls.file_threshold)
+
+    @classmethod
+    def _start(cls) -> None:
+        # Forked Worker Processes Inherit the Queue but not the Writer Thread
+        with cls._lock:
+            if cls._pid == os.getpid():
+                return
+
+            cls._queue = queue.Queue(maxsize=cls.queue_size)
+            cls._thread = threading.Thread(target=cls._drain, args=(cls._queue,), name='LogWriter', daemon=True)
+            cls._pid = os.getpid()
+
+            cls._thread.start()
+
+        return
+
+    @classmethod
+    def _drain(cls, pending: queue.Queue) -> None:
+        """ Writer thread - batches queued lines into persistent file handles """
+
+        handles = {}
+        failed = set()
+
+        running = True
+
+        while running:
+            batch = [pending.get()]
+
+            while len(batch) < cls.batch_size:
+                try:
+                    batch.append(pending.get_nowait())
+                except queue.Empty:
+                    break
+
+            try:
+                for item in batch:
+                    if item is None:
+                        running = False
+                        continue
+
+                    message, path = item
+
+                    # A Failing File must not Stop the Writer - Report it Once and Carry On
+                    try:
+                        if path not in handles:
+                            os.makedirs(os.path.dirname(path), exist_ok=True)
+                            handles[path] = open(path, 'a+')
+
+                        handles[path].write(message + '\n')
+
+                    except OSError as error:
+                        handles.pop(path, None)
+
+                        if path not in failed:
+                            failed.add(path)
+                            print(f'Unable to Write Log File {path}: {error}', file=sys.stderr)
+
+                for path, handle in list(handles.items()):
+                    try:
+                        handle.flush()
+                    except OSError as error:
+                        handles.pop(path)
+                        print(f'Unable to Write Log File {path}: {error}', file=sys.stderr)
+
+            finally:
+                for _ in batch:
+                    pending.task_done()
+
+        for handle in handles.values():
+            try:
+                handle.close()
+            except OSError:
+                pass
+
+        return
+
+    @classmethod
+    def _put(cls, message: str, path: str) -> None:
+        if cls._pid != os.getpid():
+            cls._start()
+
+        if cls._thread.is_alive():
+            try:
+                cls._queue.put((message, path), timeout=cls.put_timeout)
+                return
+
+            except queue.Full:
+                pass
+
+        # Writer Stopped or Stalled - Write Directly, Dropping the Line if that Fails too
+        try:
+            with open(path, 'a') as file:
+                file.write(message + '\n')
+
+        except OSError:
+            pass
+
+        return
+
     @classmethod
     def _write(cls, message: str, *, error: bool = False) -> None:
-        with open(cls.logfiles['events'], 'a+') as log:
-            log.write(message +'\n')
-        
+        cls._put(message, cls.logfiles['events'])
+
         if error:
-            with open(cls.logfiles['errors'], 'a+') as log:
-                log.write(message + '\n')
-        
+            cls._put(message, cls.logfiles['errors'])
+
+        return
+
+    @classmethod
+    def record(cls, event: str, **fields) -> None:
+        """ Writes one JSON line to the structured sink (when `structured` is enabled) """
+
+        if not cls.structured:
+            return
+
+        payload = {'time': datetime.now().isoformat(timespec='milliseconds'), 'event': event, **fields}
+        cls._put(json.dumps(payload, default=str), cls.structuredfile)
+
+        return
+
+    @classmethod
+    def flush(cls) -> None:
+        """ Blocks until every queued message has been written """
+
+        # A Dead Writer would never Mark its Pending Lines Done
+        if cls._pid == os.getpid() and cls._thread.is_alive():
+            cls._queue.join()
+
+        return
+
+    @classmethod
+    def close(cls) -> None:
+        """ Flushes and stops the writer thread (registered to run at exit) """
+
+        if cls._pid == os.getpid() and cls._thread.is_alive():
+            cls._queue.put(None)
+            cls._thread.join()
+
         return
-    
+
     @classmethod
     def _print(cls, message: int, *, level: str) -> None:
         if cls.levels.index(level) >= cls.threshold:
             print(message)
-        
+
         return
 
     @staticmethod
@@ -68,63 +235,157 @@ class CustomLogger():
 
         file = f"[{cls.levels[level]}] {timestamp} | {message}"
         color = f"{cls.colors[level]}[{cls.levels[level]}]{Style.RESET_ALL} {timestamp} | {message}"
-        
+
         return (file, color)
-    
+
     @classmethod
-    def trace(cls, message: str) -> None:
-        file, color = cls._formatMessage(0, message)
+    def _log(cls, level: int, message: str) -> None:
+        # Gate on Level before Timestamping or Formatting
+        if not cls.enabled(level):
+            return
+
+        file, color = cls._formatMessage(level, message)
+
+        if level >= cls.file_threshold:
+            cls._write(file, error=level >= 3)
+            cls.record('log', level=cls.levels[level], message=message)
 
-        cls._write(file, error=False)
-        cls._print(color, level='TRACE')
+        cls._print(color, level=cls.levels[level])
 
         return
 
+    @staticmethod
+    def span(name: str, **fields):
+        """
+            Times a block of work as a context manager or decorator (see `Span`)
+
+                with log.span('geocode') as span:
+                    ...
+                    span.update(rows=len(table))
+
+                @log.span('split')
+                def split(...): ...
+        """
+
+        return Span(name, **fields)
+
     @classmethod
-    def debug(cls, message: str) -> None:
-        file, color = cls._formatMessage(1, message)
+    def trace(cls, message: str) -> None:
+        cls._log(0, message)
 
-        cls._write(file, error=False)
-        cls._print(color, level='DEBUG')
+        return
+
+    @classmethod
+    def debug(cls, message: str) -> None:
+        cls._log(1, message)
 
         return
-    
+
     @classmethod
     def state(cls, message: str) -> None:
-        file, color = cls._formatMessage(2, message)
-
-        cls._write(file, error=False)
-        cls._print(color, level='STATE')
+        cls._log(2, message)
 
         return
-    
+
     @classmethod
     def issue(cls, message: str) -> None:
-        file, color = cls._formatMessage(3, message)
-
-        cls._write(file, error=True)
-        cls._print(color, level='ISSUE')
+        cls._log(3, message)
 
         return
-    
+
     @classmethod
     def error(cls, message: str) -> None:
-        file, color = cls._formatMessage(4, message)
-
-        cls._write(file, error=True)
-        cls._print(color, level='ERROR')
+        cls._log(4, message)
 
         return
 
     @classmethod
     def fatal(cls, message: str) -> None:
-        file, color = cls._formatMessage(5, message)
-
-        cls._write(file, error=True)
-        cls._print(color, level='FATAL')
+        cls._log(5, message)
 
         return
 
 
+class Span():
+    """
+        Timing span emitted through CustomLogger
+
+        Records start and end events (duration, row count, memory and any extra
+        fields) to the structured sink and logs a DEBUG summary when it completes.
+        The OS only reports the process's lifetime peak RSS, so a span records that
+        peak and how far the span itself raised it (0 when an earlier stage peaked higher)
+        As a decorator, the row count is taken from the wrapped function's result
+        when it is a table or array
+    """
+
+    _active = threading.local()
+
+    def __init__(self, name: str, **fields):
+        self.name = name
+        self.fields = fields
+
+    def update(self, **fields) -> None:
+        self.fields.update(fields)
+
+    @staticmethod
+    def peak_rss() -> float:
+        """ Lifetime peak resident set size of this process in MB (None where unsupported) """
+
+        if resource is None:
+            return None
+
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        # Reported in Bytes on macOS and Kilobytes on Linux
+        return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+    def __enter__(self):
+        stack = self._active.__dict__.setdefault('stack', [])
+
+        self.parent = stack[-1] if stack else None
+        stack.append(self.name)
+
+        self.rss = self.peak_rss()
+
+        CustomLogger.record(
+            'span', phase='start', span=self.name, parent=self.parent, process_peak_rss_mb=self.rss, **self.fields
+        )
+        self.start = time.perf_counter()
+
+        return self
+
+    def __exit__(self, kind, error, traceback) -> bool:
+        duration = time.perf_counter() - self.start
+        self._active.stack.pop()
+
+        rss = self.peak_rss()
+        growth = round(rss - self.rss, 1) if rss is not None else None
+        status = 'ok' if kind is None else 'error'
+
+        CustomLogger.record(
+            'span', phase='end', span=self.name, parent=self.parent, status=status, duration_s=round(duration, 4),
+            process_peak_rss_mb=rss, peak_rss_growth_mb=growth, **self.fields
+        )
+
+        rows = f' | {self.fields["rows"]} Rows' if 'rows' in self.fields else ''
+        memory = f' | Process Peak RSS: {rss} MB (+{growth} MB)' if rss is not None else ''
+
+        CustomLogger.debug(f'[{self.name}] {"Completed" if kind is None else "Failed"} in {duration:.2f}s{rows}{memory}')
+
+        return False
+
+    def __call__(self, func):
+        @functools.wraps(func)
+        def timed(*args, **kwargs):
+            with Span(self.name, **self.fields) as span:
+                result = func(*args, **kwargs)
+
+                if hasattr(result, 'shape') or (hasattr(result, '__len__') and not isinstance(result, (str, bytes, dict, list, tuple, set))):
+                    span.update(rows=len(result))
+
+                return result
+
+        return timed
+
 
-    
\ No newline at end of file
+atexit.register(CustomLogger.close)
@@ -0,0 +1,100 @@
+import os
+import json
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pyarrow.feather as feather
+
+from ..logger import CustomLogger as log
+
+
+class Artifacts():
+    """
+        Columnar storage for pipeline stage outputs
+
+        Tables are written as Arrow Feather (memory-mapped on load) or Parquet.
+        (Lat, Long) tuple columns are stored as two native float columns and
+        rebuilt on load, so every column keeps its dtype across a round trip
+    """
+
+    directory = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'static')
+
+    # 'feather' or 'parquet'
+    format: str = 'feather'
+
+    # Also Write a CSV Copy of every Artifact (for Spreadsheets / Manual Inspection)
+    export_csv: bool = False
+
+    # Tuple Columns -> Float Column Pairs they are Stored as
+    points = {
+        'Coordinates': ('Latitude', 'Longitude'),
+        'Cluster Centre': ('Cluster Latitude', 'Cluster Longitude'),
+        'Cluster Center': ('Cluster Latitude', 'Cluster Longitude')
+    }
+
+    @classmethod
+    def path(cls, name: str) -> str:
+        """ Artifact path for a stage output name (e.g. 'clusters') in the configured format """
+
+        return os.path.join(cls.directory, f'{name}.{cls.format}')
+
+    @classmethod
+    def write(cls, table: pd.DataFrame, path: str) -> None:
+        log.debug(f'Saving {os.path.basename(path)}...')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        table = table.copy(deep=False)
+        order = list(table.columns)
+        packed = []
+
+        for column, (lat, lon) in cls.points.items():
+            if column not in table:
+                continue
+
+            if lat not in table or lon not in table:
+                pairs = pd.DataFrame(table[column].tolist(), index=table.index, columns=[lat, lon], dtype=float)
+                table[[lat, lon]] = pairs
+                order += [lat, lon]
+
+            table = table.drop(columns=column)
+            packed.append(column)
+
+        arrow = pa.Table.from_pandas(table)
+        arrow = arrow.replace_schema_metadata({
+            **arrow.schema.metadata,
+            b'points': json.dumps(packed).encode(),
+            b'order': json.dumps(order).encode()
+        })
+
+        if path.endswith('.parquet'):
+            pq.write_table(arrow, path)
+        else:
+            feather.write_feather(arrow, path)
+
+        if cls.export_csv:
+            table.to_csv(os.path.splitext(path)[0] + '.csv')
+
+        return
+
+    @classmethod
+    def read(cls, path: str) -> pd.DataFrame:
+        if path.endswith('.parquet'):
+            arrow = pq.read_table(path, memory_map=True)
+        else:
+            arrow = feather.read_table(path, memory_map=True)
+
+        # Single-Column Blocks let Null-Free Numeric Columns Share the Mapped Buffers
+        table = arrow.to_pandas(split_blocks=True)
+
+        metadata = arrow.schema.metadata or {}
+        packed = json.loads(metadata.get(b'points', b'[]'))
+
+        for column in packed:
+            lat, lon = cls.points[column]
+            table[column] = list(zip(table[lat].tolist(), table[lon].tolist()))
+
+        if b'order' in metadata:
+            table = table[json.loads(metadata[b'order'])]
+
+        return table
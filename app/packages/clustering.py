@@ -1,12 +1,15 @@
-import math
+import time
 import warnings
 
 import numpy as np
 import pandas as pd
 
 from tqdm import tqdm
-from dataclasses import dataclass
 
+from .matrix import DistanceMatrix
+from .spatial import SpatialIndex
+from .distance import Haversine
+from .clustertable import ClusterTable
 from ..logger import CustomLogger as log
 
 
@@ -14,18 +17,26 @@ from ..logger import CustomLogger as log
 warnings.filterwarnings("ignore", category=FutureWarning)
 
 
-@dataclass
-class Cluster:
-    centre: tuple
-    points: list
-
-
 class EngineSetup():
     radius_mi: int = 200
     radius_km: float = radius_mi * 1.6
 
     min_cluster_size = 80
     max_cluster_size = 150
+
+    # Compute Neighborhoods from a Complete Distance Matrix Memory-Mapped under app/static/
+    # (reused across runs for the same store locations) instead of the in-memory Spatial Index
+    mapped_matrix: bool = False
+
+    # Worker Processes for Distance, Density and Assignment Stages (1 = Serial, 0 = All Cores)
+    workers: int = 1
+
+    # Centroid Refinement: Maximum Align Passes and the Centre Shift (km) below which Refinement Stops
+    max_iterations: int = 10
+    tolerance_km: float = 0.5
+
+    # Cluster Table from the Most Recent Assignment (indexed by "Cluster ID")
+    clusters: ClusterTable = None
     
     @staticmethod
     def geodesic_distance(start: tuple, end: tuple) -> float:
@@ -40,25 +51,7 @@ class EngineSetup():
                 Float value representing the distance between the two points in kilometers
         """
 
-        # Earth's Radius in Kilometers (approximate)
-        r = 6371.0
-
-        lat1 = math.radians(start[0])
-        lon1 = math.radians(start[1])
-
-        lat2 = math.radians(end[0])
-        lon2 = math.radians(end[1])
-
-        xdelta = lon2 - lon1
-        ydelta = lat2 - lat1
-
-        # Haversine Formulae
-        a = (math.sin(ydelta / 2) ** 2) + math.cos(lat1) * math.cos(lat2) * (math.sin(xdelta / 2) **2)
-        c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
-
-        distance = r * c
-
-        return distance
+        return Haversine.between(start, end)
     
     @classmethod
     def calculate_pair_wise(cls, stores: pd.DataFrame, *, start: tuple) -> list:
@@ -73,20 +66,18 @@ class EngineSetup():
                 2-D Array containing [start, point, distance] lists
         """
 
-        array = []
-
         log.trace(f'Calculating Distance Matrix for Point: {start}')
 
-        for _, row in stores.iterrows():
-            point = (row["Latitude"], row["Longitude"])
-
-            if point == start:
-                continue
+        points = Haversine.coordinates(stores)
+        distances = Haversine.one_to_many(start, points)
 
-            distance = cls.geodesic_distance(start, point)
-            entry = [start, point, distance]
+        # Exclude the Starting Point (and any co-located points)
+        keep = ~((points[:, 0] == start[0]) & (points[:, 1] == start[1]))
 
-            array.append(entry)
+        array = [
+            [start, tuple(point), distance]
+            for point, distance in zip(points[keep].tolist(), distances[keep].tolist())
+        ]
         
         return array
     
@@ -94,7 +85,8 @@ class EngineSetup():
 class ClusterEngine(EngineSetup):
 
     @classmethod
-    def build_distance_matrix(cls, *, stores: pd.DataFrame) -> pd.DataFrame:
+    @log.span('cluster.distance_matrix')
+    def build_distance_matrix(cls, *, stores: pd.DataFrame):
         """
             Calculates pair-wise distances for each point combination
 
@@ -102,65 +94,56 @@ class ClusterEngine(EngineSetup):
                 stores: A Pandas DataFrame containing Latitude and Longitude Columns
             
             Returns:
-                A dataframe containing the distance between each combination of points
+                An index-addressed distance store (dense for small books, sparse within `radius_km` otherwise)
         """
 
         log.state('Calculating Distance Matrix...')
 
-        distances = []
-        for _, row in stores.iterrows():
-            distances.extend(
-                cls.calculate_pair_wise(stores, start=(row["Latitude"], row["Longitude"]))
+        # Create Progress Bar
+        print()
+        with tqdm(total=len(stores), desc="Calculating Distance Matrix", colour="green", leave=True) as pbar:
+            matrix = DistanceMatrix.build(
+                stores, radius=cls.radius_km, mapped=cls.mapped_matrix, progress=pbar.update, workers=cls.workers
             )
 
-        matrix = pd.DataFrame(distances, columns=["From", "To", "Distance"])
+            pbar.close()
+
+        print()
 
         return matrix
 
     @classmethod
-    def relative_density(cls, *, stores: pd.DataFrame) -> pd.DataFrame:
+    @log.span('cluster.density')
+    def relative_density(cls, *, stores: pd.DataFrame, distances=None) -> pd.DataFrame:
         """
-            Analyzes Distance Matrix to determine relative density per store
+            Analyzes neighboring stores within range to determine relative density per store
 
             Args:
-                stores: A Pandas DataFrame containing Store Information
+                stores:     A Pandas DataFrame containing Store Information
+                distances:  Optional distance store from `build_distance_matrix`
             
             Returns:
                 `stores` dataframe with additional columns
         """ 
 
-        distances = cls.build_distance_matrix(stores=stores)
+        if distances is None:
+            log.state('Indexing Store Locations...')
+            distances = SpatialIndex(stores, cell_km=cls.radius_km)
 
-        stores["Neighbors"] = np.nan
-        stores["Relative Density"] = np.nan
-
-        log.state('Analyzing Distance Matrix...')
+        log.state('Analyzing Store Neighborhoods...')
 
         # Create Progress Bar
         print()
         with tqdm(total=len(stores), desc="Calculating Relative Density", colour="green", leave=True) as pbar:
-            for i, row in stores.iterrows():
-                point = (row["Latitude"], row["Longitude"])
-
-                # Find Stores within Range
-                neighbors = distances.loc[
-                    ((distances["From"] == point) & distances["Distance"] < cls.radius_km)
-                ]
-
-                population = len(neighbors)
-                avg_distance = neighbors["Distance"].mean()
-
-                density = population / avg_distance
-
-                stores.at[i, "Neighbors"] = population
-                stores.at[i, "Relative Density"] = density
-
-                pbar.update(1)
+            population, avg_distance = distances.neighbor_stats(cls.radius_km, progress=pbar.update, workers=cls.workers)
 
             pbar.close()
         
         print()
 
+        stores["Neighbors"] = population
+        stores["Relative Density"] = population / avg_distance
+
         return stores
 
     @classmethod
@@ -193,14 +176,14 @@ class ClusterEngine(EngineSetup):
                 point = (row["Latitude"], row["Longitude"])
 
                 # Calculate Distance Relative to Known Centrepoints
-                proximity = [cls.geodesic_distance(point, centrepoint) for centrepoint in centrepoints]
+                proximity = Haversine.one_to_many(point, centrepoints)
 
                 if row["Neighbors"] > cls.max_cluster_size:
-                    existing = [distance > cls.radius_km for distance in proximity]
+                    existing = proximity > cls.radius_km
                 else:
-                    existing = [distance > (cls.radius_km * 2) for distance in proximity]
+                    existing = proximity > (cls.radius_km * 2)
                 
-                if len(centrepoints) == 0 or all(existing):
+                if len(centrepoints) == 0 or existing.all():
                     centrepoints.append(point)
                 
                 pbar.update(1)
@@ -227,30 +210,18 @@ class ClusterEngine(EngineSetup):
 
         log.state('Locating Closest Cluster Centrepoint...')
 
-        stores["Cluster Centre"] = [() for _ in range(len(stores))]
-
         # Create a Progress Bar
         print()
         with tqdm(total=len(stores), desc="Assigning Centrepoints", colour="green", leave=True) as pbar:
-            for i, row in stores.iterrows():
-                point = (row["Latitude"], row["Longitude"])
-
-                if point in centrepoints:
-                    stores.at[i, "Cluster Centre"] = point
-                
-                else:
-                    proximity = [
-                        cls.geodesic_distance(point, centrepoint)
-                        for centrepoint in centrepoints
-                    ]
+            closest, distances = Haversine.nearest(stores, centrepoints, workers=cls.workers, progress=pbar.update)
 
-                    closest = centrepoints[proximity.index(min(proximity))]
+            pbar.close()
 
-                    stores.at[i, "Cluster Centre"] = closest
-                
-                pbar.update()
+        cls.clusters = ClusterTable(centrepoints).record(closest, distances)
 
-            pbar.close()
+        stores["Cluster ID"] = closest.astype(np.int32)
+        stores["Centre Distance"] = distances
+        stores["Cluster Latitude"], stores["Cluster Longitude"] = cls.clusters.locate(closest)
         
         print()
         log.debug('Cluster Assignment Completed')
@@ -271,24 +242,50 @@ class ClusterEngine(EngineSetup):
 
         log.state('Aligning Clusters...')
 
-        centrepoints = stores["Cluster Centre"].unique()
+        centroids = ClusterTable.centroids(stores, stores["Cluster ID"].to_numpy())
 
-        clusters = {
-            centrepoint: stores[stores["Cluster Centre"] == centrepoint]
-            for centrepoint in centrepoints
-        }
+        stores = cls.assign_closest_cluster(stores=stores, centrepoints=centroids.centres)
 
-        centroids = []
+        return stores
+    
+    @classmethod
+    @log.span('cluster.refine')
+    def refine(cls, *, stores: pd.DataFrame) -> pd.DataFrame:
+        """
+            Repeats `align_to_center` until the clusters converge
 
-        for cluster, points in clusters.items():
-            centroid = (points["Latitude"].mean(), points["Longitude"].mean())
-            centroids.append(centroid)
-        
-        stores = cls.assign_closest_cluster(stores=stores, centrepoints=centroids)
+            Stops once no store changes cluster, the largest centre shift falls below
+            `tolerance_km` or `max_iterations` passes have run
+
+            Args:
+                stores: A dataframe containing store information and cluster assignments
+            
+            Returns:
+                A dataframe containing store information with refined cluster assignments
+        """
+
+        for iteration in range(1, cls.max_iterations + 1):
+            start = time.perf_counter()
+
+            before, before_ids = cls.clusters, stores["Cluster ID"].to_numpy().copy()
+
+            stores = cls.align_to_center(stores=stores)
+            moved, shift = ClusterTable.movement(before, before_ids, cls.clusters, stores["Cluster ID"].to_numpy())
+
+            log.debug(
+                f'Refinement Pass {iteration}/{cls.max_iterations}: {moved} Stores Moved | '
+                f'Max Centre Shift: {shift:.3f} km | {time.perf_counter() - start:.2f}s'
+            )
+
+            if moved == 0 or shift < cls.tolerance_km:
+                log.debug(f'Clusters Converged after {iteration} Refinement Passes')
+
+                break
 
         return stores
-    
+
     @classmethod
+    @log.span('cluster')
     def cluster(cls, *, stores: pd.DataFrame) -> pd.DataFrame:
         """
             Orchestrates the Functioning of the Cluster Engine
@@ -300,11 +297,18 @@ class ClusterEngine(EngineSetup):
                 A dataframe containing store information and cluster assignments
         """
 
-        densities = cls.relative_density(stores=stores)
+        distances = cls.build_distance_matrix(stores=stores) if cls.mapped_matrix else None
+
+        densities = cls.relative_density(stores=stores, distances=distances)
         centrepoints = cls.identify_centrepoints(stores=densities)
 
         unaligned_clusters = cls.assign_closest_cluster(stores=densities, centrepoints=centrepoints)
-        aligned_clusters = cls.align_to_center(stores=unaligned_clusters)
+        aligned_clusters = cls.refine(stores=unaligned_clusters)
+
+        # Centre Tuples are only Materialized for the Final Output (Mapping / Export)
+        aligned_clusters["Cluster Centre"] = list(zip(aligned_clusters["Cluster Latitude"], aligned_clusters["Cluster Longitude"]))
+
+        log.debug(f'Formed {int((cls.clusters.size > 0).sum())} Clusters (Largest: {cls.clusters.size.max()} Stores)')
 
         return aligned_clusters
 
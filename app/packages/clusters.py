@@ -1,4 +1,4 @@
-import math
+import time
 import warnings
 
 import numpy as np
@@ -6,48 +6,16 @@ import pandas as pd
 
 from tqdm import tqdm
 
+from .matrix import DistanceMatrix
+from .spatial import SpatialIndex
+from .distance import Haversine
+from .clustertable import ClusterTable
 from ..logger import CustomLogger as log
 
 
 warnings.filterwarnings("ignore", category=FutureWarning)
 
 
-class Cluster():
-
-    ''' 
-        Insert DocString Here
-    
-    '''
-
-    def __init__(self, id: int = 0, *, centre: tuple):
-        self.id = id
-        self.points = []
-        self.centre = centre
-
-        log.trace(f'Initializing New Cluster {id} with Centre: {centre}')
-        self.assign(centre)     
-
-    def assign(self, point: tuple):
-        self.points.append(point)
-
-        log.trace(f'Assigning Point {point} to Cluster {self.id}')
-
-    def unassign(self, point: tuple):
-        try:
-            index = self.points.index(point)
-            self.points.pop(index)
-
-        except ValueError:
-            log.issue(f'Unable to Remove Point {point} from Cluster {self.id} - Point Not In Cluster')
-        except IndexError:
-            log.issue(f'Unable to Remove Point {point} from Cluster {self.id} - Invalid Cluster Index')
-        
-        else:
-            log.trace(f'Unassigned Point {point} from Cluster {self.id}')
-        
-        return
-
-
 class ClusterEngine():
 
     _radius = 200
@@ -55,102 +23,64 @@ class ClusterEngine():
 
     min_size = 80
     max_size = 150
-       
 
-    @staticmethod
-    def haversine(a: list, b: list):
-        r = 6371.0
-
-        ay = math.radians(a[0])
-        ax = math.radians(a[1])
-
-        by = math.radians(b[0])
-        bx = math.radians(b[1])
+    # Back the Distance Matrix with a Memory-Mapped File under app/static/
+    mapped = False
 
-        xdelta = bx - ax
-        ydelta = by - ay
+    # Worker Processes for Distance, Density and Assignment Stages (1 = Serial, 0 = All Cores)
+    workers = 1
 
-        z = (math.sin(ydelta / 2) ** 2) + math.cos(ay) * math.cos(by) * (math.sin(xdelta / 2) ** 2)
-        d = 2 * math.atan2(math.sqrt(z), math.sqrt(1 - z))
+    # Farthest-Pair Search used by `split` ('hull' or 'exact') and Hull Boundary Tolerance (km)
+    split_method = 'hull'
+    split_tolerance = 1.0
 
-        distance = r * d
+    # Centroid Refinement: Maximum Align Passes and the Centre Shift (km) below which Refinement Stops
+    max_iterations = 10
+    tolerance = 0.5
 
-        return distance
+    # Cluster Table from the Most Recent Assignment (indexed by "Cluster ID")
+    clusters = None
+       
 
     @staticmethod
-    def distanceToCenter(point: tuple, center: tuple, distances: pd.DataFrame):
-        row = distances.loc[
-            ((distances["From"] == point) & (distances["To"] == center)),
-            "Distance"
-        ]
+    def haversine(a: list, b: list):
+        return Haversine.between(a, b)
 
-        try:
-            return row.values[0]
-        except IndexError:
-            pass
+    @staticmethod
+    def distanceToCenter(point: int, center: int, distances):
+        return distances.distance(point, center)
 
     
     @classmethod
+    @log.span('cluster.distance_matrix')
     def distanceMatrix(cls, df: pd.DataFrame):
-        dmatrix = []
-
         log.state('Initializing Distance Matrix...')
-        total = (len(df) ** 2) - len(df)
         print()
 
-        with tqdm(total=total, desc="Calculating Distance Matrix", colour="green", leave=True) as pbar:
-            for start, startrow in df.iterrows():
-                a = (startrow["Latitude"], startrow["Longitude"])
+        with tqdm(total=len(df), desc="Calculating Distance Matrix", colour="green", leave=True) as pbar:
+            matrix = DistanceMatrix.build(df, radius=cls.radius, mapped=cls.mapped, progress=pbar.update, workers=cls.workers)
 
-                log.trace(f'Building Distance Matrix for Point {a}')
-                for end, endrow in df.iterrows():
-                    if start == end:
-                        continue
-                    
-                    else:
-                        b = (endrow["Latitude"], endrow["Longitude"])
-
-                        dmatrix.append([
-                            a,
-                            b,
-                            cls.haversine(a, b)
-                        ])
-                    
-                    pbar.update(1)
-                
-                continue
         print()        
-        log.debug('Converting Matrix to DataFrame...')
         
-        return pd.DataFrame(dmatrix, columns=["From", "To", "Distance"])
+        return matrix
     
     @classmethod
-    def neighborhood(cls, *, stores: pd.DataFrame, distances: pd.DataFrame):
+    @log.span('cluster.neighborhood')
+    def neighborhood(cls, *, stores: pd.DataFrame, distances=None):
         total = len(stores)
 
-        stores["Neighbors"] = np.nan
-        stores["Total Density"] = np.nan
-
         log.state('Creating Neighborhood Mappings...')
         print()
 
-        with tqdm(total=total, desc="Calculating Neighborhood Metrics", colour="green", leave=True) as pbar:
-            for index, store in stores.iterrows():
-                log.trace(f'Calculating Neighborhood Metrics for {store["Account_Number"]}')
-                coords = (store["Latitude"], store["Longitude"])
+        if distances is None:
+            distances = SpatialIndex(stores, cell_km=cls.radius)
 
-                neighbors = distances.loc[
-                    ((distances["From"] == coords) & (distances["Distance"] < cls.radius))
-                ]
-
-                population = len(neighbors)
-                density = neighbors["Distance"].mean()
+        with tqdm(total=total, desc="Calculating Neighborhood Metrics", colour="green", leave=True) as pbar:
+            population, density = distances.neighbor_stats(cls.radius, progress=pbar.update, workers=cls.workers)
 
-                stores.at[index, "Neighbors"] = population
-                stores.at[index, "Total Density"] = density
+        stores["Neighbors"] = population
+        stores["Total Density"] = density
 
-                pbar.update(1)
-        
         print()
         
         return stores
@@ -161,8 +91,7 @@ class ClusterEngine():
 
         sorted = neighborhood.sort_values(by=["Total Density"], ascending=False).reset_index(drop=True)
 
-        i = 0
-        clusters = []
+        centrepoints = []
 
         print()
 
@@ -174,53 +103,35 @@ class ClusterEngine():
                     continue
                     
                 coords = (row["Latitude"], row["Longitude"])
-                centrepoints = [cluster.centre for cluster in clusters]
-
-                if coords in centrepoints:
-                    continue
 
-                proximity = [cls.haversine(coords, centrepoint) for centrepoint in centrepoints]
+                # An Existing Centre is within 2 * radius of itself, so it is never Re-Added
+                proximity = Haversine.one_to_many(coords, centrepoints)
 
-                if len(clusters) == 0 or all([distance > (2 * cls.radius) for distance in proximity]):
-                    cluster = Cluster(i, centre=coords)
-                    clusters.append(cluster)
-
-                    i += 1
+                if len(centrepoints) == 0 or (proximity > (2 * cls.radius)).all():
+                    centrepoints.append(coords)
                 
                 pbar.update(1)
             
         print()
-        log.debug(f'Identified {len(clusters)} high-density points')
+        log.debug(f'Identified {len(centrepoints)} high-density points')
         
-        return clusters
+        return ClusterTable(centrepoints)
 
 
     @classmethod
-    def getClosestCluster(cls, *, stores: pd.DataFrame, clusters: list):
+    def getClosestCluster(cls, *, stores: pd.DataFrame, clusters: ClusterTable):
         log.state('Setting Point Clusters...')
 
-        stores["Cluster Center"] = [() for _ in range(len(stores))]
-        centrepoints = [cluster.centre for cluster in clusters]
-
         print()
 
         with tqdm(total=len(stores), desc="Finding Closest Cluster Centre", colour="green", leave=True) as pbar:
+            closest, distances = Haversine.nearest(stores, clusters.centres, workers=cls.workers, progress=pbar.update)
 
-            for index, row in stores.iterrows():
-                coords = (row["Latitude"], row["Longitude"])
+        cls.clusters = clusters.record(closest, distances)
 
-                if coords in centrepoints:
-                    stores.at[index, "Cluster Center"] = coords
-                
-                else:
-                    proximity = [cls.haversine(coords, centrepoint,) for centrepoint in centrepoints]
-                    closest = centrepoints[proximity.index(min(proximity))]
-
-                    stores.at[index, "Cluster Center"] = closest
-                
-                pbar.update(1)
-
-                continue
+        stores["Cluster ID"] = closest.astype(np.int32)
+        stores["Center Distance"] = distances
+        stores["Cluster Latitude"], stores["Cluster Longitude"] = clusters.locate(closest)
         
         print()
         log.debug('Cluster Assignment Completed')
@@ -229,18 +140,7 @@ class ClusterEngine():
 
     @classmethod
     def alignCentroid(cls, df: pd.DataFrame):
-        focalpoints= df["Cluster Center"].unique()
-
-        clusters = {
-            focalpoint: df[df["Cluster Center"] == focalpoint]
-            for focalpoint in focalpoints
-        }
-
-        centroids = []
-
-        for cluster, points in clusters.items():
-            centroid = (points["Latitude"].mean(), points["Longitude"].mean())
-            centroids.append(Cluster(0, centre=centroid))
+        centroids = ClusterTable.centroids(df, df["Cluster ID"].to_numpy())
         
         stores = cls.getClosestCluster(stores=df, clusters=centroids)
 
@@ -248,62 +148,216 @@ class ClusterEngine():
         
     
     @classmethod
-    def split(cls, *, stores: pd.DataFrame, max_size: int = 250):
-        centrepoints = stores["Cluster Center"].unique()
-        log.state('Optimizing Cluster Size...')
+    @log.span('cluster.refine')
+    def refine(cls, df: pd.DataFrame):
+        """ Repeats `alignCentroid` until no store moves, centres shift less than `tolerance` km or `max_iterations` is reached """
 
-        clusters = {
-            centrepoint: stores[stores["Cluster Center"] == centrepoint]
-            for centrepoint in centrepoints
-        }
+        for iteration in range(1, cls.max_iterations + 1):
+            start = time.perf_counter()
 
-        x = 1
-        centrepoints = []
+            before, before_ids = cls.clusters, df["Cluster ID"].to_numpy().copy()
 
-        for cluster, points in clusters.items():
-            if len(points) > max_size:
-                max_distance = -float("inf")
+            df = cls.alignCentroid(df)
+            moved, shift = ClusterTable.movement(before, before_ids, cls.clusters, df["Cluster ID"].to_numpy())
 
-                point1, point2 = None, None
+            log.debug(
+                f'Refinement Pass {iteration}/{cls.max_iterations}: {moved} Stores Moved | '
+                f'Max Centre Shift: {shift:.3f} km | {time.perf_counter() - start:.2f}s'
+            )
 
-                print()
-                with tqdm(total=len(points), desc=f"Optimizing Cluster: {x}/{len(clusters)}", leave=True, colour="green") as pbar:
+            if moved == 0 or shift < cls.tolerance:
+                log.debug(f'Clusters Converged after {iteration} Refinement Passes')
+
+                break
 
-                    for index, row in points.iterrows():
-                        coord1 = (row["Latitude"], row["Longitude"])
+        return df
 
-                        for _index, _row in points.iterrows():
-                            coord2 = (_row["Latitude"], _row["Longitude"])
+    @staticmethod
+    def convexHull(points: np.ndarray) -> np.ndarray:
+        # Andrew's Monotone Chain over projected (x, y) points - returns vertex indices
+        order = np.lexsort((points[:, 1], points[:, 0])).tolist()
 
-                            if index == _index:
-                                continue
+        if len(order) < 3:
+            return np.asarray(order, dtype=np.int64)
 
-                            distance = sum((
-                                cls.haversine(coord1, cluster),
-                                cls.haversine(coord2, cluster),
-                                cls.haversine(coord1, coord2)
-                            ))
+        xy = points.tolist()
 
-                            if distance > max_distance:
-                                max_distance = distance
-                                point1 = coord1
-                                point2 = coord2
+        def cross(o, a, b):
+            return (xy[a][0] - xy[o][0]) * (xy[b][1] - xy[o][1]) - (xy[a][1] - xy[o][1]) * (xy[b][0] - xy[o][0])
 
-                            continue
-                        
-                        pbar.update(1)
+        lower, upper = [], []
+
+        for i in order:
+            while len(lower) >= 2 and cross(lower[-2], lower[-1], i) <= 0:
+                lower.pop()
+            lower.append(i)
 
-                        continue
+        for i in reversed(order):
+            while len(upper) >= 2 and cross(upper[-2], upper[-1], i) <= 0:
+                upper.pop()
+            upper.append(i)
+
+        return np.asarray(lower[:-1] + upper[:-1], dtype=np.int64)
+
+    @classmethod
+    def hullCandidates(cls, coords: np.ndarray, centre: tuple, *, tolerance: float = 0.0) -> np.ndarray:
+        # Local Equirectangular Projection (km) around the Cluster Centre
+        lat0, lon0 = centre
+
+        x = ((coords[:, 1] - lon0 + 180) % 360 - 180) * np.cos(np.radians(lat0)) * SpatialIndex.km_per_degree
+        y = (coords[:, 0] - lat0) * SpatialIndex.km_per_degree
+
+        xy = np.column_stack((x, y))
+        hull = cls.convexHull(xy)
+
+        if tolerance <= 0 or len(hull) < 3:
+            return hull
+
+        # Widen the Candidates with Points within `tolerance` km of a Hull Edge
+        a = xy[hull]
+        ab = np.roll(a, -1, axis=0) - a
+        length = np.maximum((ab ** 2).sum(axis=1), 1e-12)
+
+        nearby = np.zeros(len(xy), dtype=bool)
+
+        for start in range(0, len(xy), Haversine.block_size):
+            ap = xy[start:start + Haversine.block_size, None, :] - a[None, :, :]
+
+            t = np.clip((ap * ab[None]).sum(axis=2) / length[None], 0, 1)
+            offset = np.sqrt(((ap - t[..., None] * ab[None]) ** 2).sum(axis=2))
+
+            nearby[start:start + Haversine.block_size] = offset.min(axis=1) <= tolerance
+
+        nearby[hull] = True
+
+        return np.flatnonzero(nearby)
+
+    @classmethod
+    def seedPair(cls, coords: np.ndarray, centre: tuple, *, members=None, distances=None, method: str = None, tolerance: float = None, progress=None) -> tuple:
+        """
+            Locates the pair of points forming the largest triangle perimeter with the cluster centre
+
+            The perimeter is convex in each point, so (in a local planar projection) the
+            optimal pair lies on the convex hull; the `hull` method only searches hull
+            vertices plus any points within `tolerance` km of the hull boundary, while
+            the `exact` method searches every pair
+
+            Args:
+                coords:     (N, 2) array of cluster member coordinates
+                centre:     Latitude/Longitude tuple for the Cluster Centre
+                members:    Store indices of the members (required when `distances` is supplied)
+                distances:  Optional complete distance store to read pair distances from
+                method:     `hull` or `exact` (defaults to `ClusterEngine.split_method`)
+                tolerance:  Hull boundary tolerance in kilometers (defaults to `ClusterEngine.split_tolerance`)
+                progress:   Optional callback receiving the number of points processed
+
+            Returns:
+                (point1, point2) Latitude/Longitude tuples - (None, None) when fewer than two members are placed
+        """
+
+        method = method or cls.split_method
+        tolerance = cls.split_tolerance if tolerance is None else tolerance
+
+        # Stores that Failed to Geocode cannot Seed a Split
+        finite = np.isfinite(coords).all(axis=1)
+
+        if not finite.all():
+            coords = coords[finite]
+            members = members[finite] if members is not None else None
+
+            if progress is not None:
+                progress(int((~finite).sum()))
+
+        if len(coords) < 2:
+            return (None, None)
+
+        if method == 'hull':
+            candidates = cls.hullCandidates(coords, centre, tolerance=tolerance)
+
+        else:
+            if method != 'exact':
+                log.issue(f'Unknown Split Method "{method}" - Searching Every Pair')
+
+            candidates = np.arange(len(coords))
+
+        log.trace(f'Searching {len(candidates)} of {len(coords)} Points for the Farthest Pair')
+
+        if progress is not None:
+            progress(len(coords) - len(candidates))
+
+        subset = coords[candidates]
+        perimeter = Haversine.one_to_many(centre, subset)
+
+        max_distance = -float("inf")
+        point1, point2 = None, None
+
+        for start in range(0, len(candidates), Haversine.block_size):
+            stop = min(start + Haversine.block_size, len(candidates))
+
+            if distances is None:
+                block = Haversine.many_to_many(subset[start:stop], subset)
+            else:
+                block = distances.block(members[candidates[start:stop]], members[candidates])
+
+            # Perimeter of the Triangle formed with the Cluster Centre
+            total = perimeter[start:stop, None] + perimeter[None, :] + block
+            total[np.arange(stop - start), np.arange(start, stop)] = -np.inf
+
+            index, _index = np.unravel_index(int(np.argmax(total)), total.shape)
+
+            if total[index, _index] > max_distance:
+                max_distance = total[index, _index]
+                point1 = tuple(subset[start + index].tolist())
+                point2 = tuple(subset[_index].tolist())
+
+            if progress is not None:
+                progress(stop - start)
+
+        return (point1, point2)
+
+    @classmethod
+    @log.span('cluster.split')
+    def split(cls, *, stores: pd.DataFrame, max_size: int = 250, distances=None):
+        log.state('Optimizing Cluster Size...')
+
+        # Positional Store Indices per Cluster (aligned with `distances`)
+        clusters = stores.groupby("Cluster ID", sort=False).indices
+
+        # Unplaced Stores (-1) are not a Cluster
+        clusters.pop(-1, None)
+        centres = stores[["Cluster Latitude", "Cluster Longitude"]].to_numpy()
+
+        # Read Pair Distances from the Distance Store only when it holds every Pair
+        if distances is not None and not distances.complete:
+            distances = None
+
+        x = 1
+        centrepoints = []
+
+        for members in clusters.values():
+            cluster = tuple(centres[members[0]].tolist())
+
+            if len(members) > max_size:
+                print()
+                with tqdm(total=len(members), desc=f"Optimizing Cluster: {x}/{len(clusters)}", leave=True, colour="green") as pbar:
+                    coords = Haversine.coordinates(stores.iloc[members])
+
+                    point1, point2 = cls.seedPair(
+                        coords, cluster, members=members, distances=distances, progress=pbar.update
+                    )
                     
-                    x += 1
+                x += 1
 
+                if point1 is None or point2 is None:
+                    centrepoints.append(cluster)
+                else:
                     centrepoints.append(point1)
                     centrepoints.append(point2)
 
             else:
                 centrepoints.append(cluster)
         
-        clusters = [Cluster(i, centre=centrepoints[i]) for i in range(len(centrepoints))]
+        clusters = ClusterTable(centrepoints)
 
         print()
         log.debug(f'Identified {len(clusters)} Optimized Clusters')
@@ -311,23 +365,27 @@ class ClusterEngine():
         return cls.getClosestCluster(stores=stores, clusters=clusters)
 
     @classmethod
-    def cluster(cls, *, stores: pd.DataFrame):
+    @log.span('cluster')
+    def cluster(cls, *, stores: pd.DataFrame, distances=None):
         log.state('Running Clustering Alogrithm (Iteration 1 of 1) ...')
         centrepoints = cls.getClusterCentres(neighborhood=stores)
         first_pass = cls.getClosestCluster(stores=stores, clusters=centrepoints)
-        first_alignment = cls.alignCentroid(first_pass)
+        first_alignment = cls.refine(first_pass)
         
         log.state('Running Cluster Optimization Algorithm (Iteration 1 of 3) ...')
-        second_pass = cls.split(stores=first_alignment)
-        second_alignment = cls.alignCentroid(second_pass)
+        second_pass = cls.split(stores=first_alignment, distances=distances)
+        second_alignment = cls.refine(second_pass)
 
         log.state('Running Cluster Optimization Algorithm (Iteration 2 of 3) ...')
-        third_pass = cls.split(stores=second_alignment, max_size=160)
-        third_alignment = cls.alignCentroid(third_pass)
+        third_pass = cls.split(stores=second_alignment, max_size=160, distances=distances)
+        third_alignment = cls.refine(third_pass)
 
         log.state('Running Final Cluster Optimization Algorithm (Iteration 3 of 3) ...')
-        final_pass = cls.split(stores=third_alignment, max_size=120)
-        final_alignment = cls.alignCentroid(final_pass)
+        final_pass = cls.split(stores=third_alignment, max_size=120, distances=distances)
+        final_alignment = cls.refine(final_pass)
+
+        # Centre Tuples are only Materialized for the Final Output (Mapping / Export)
+        final_alignment["Cluster Center"] = list(zip(final_alignment["Cluster Latitude"], final_alignment["Cluster Longitude"]))
 
         return final_alignment
 
@@ -0,0 +1,139 @@
+import numpy as np
+import pandas as pd
+
+from .distance import Haversine
+
+
+class ClusterTable():
+    """
+        Compact per-cluster summary held in parallel NumPy arrays
+
+        Row k describes cluster id k: its centre and, once stores are assigned,
+        the member count and the mean / max member distance to the centre (km).
+        Stores without coordinates carry the id -1 and belong to no cluster
+    """
+
+    __slots__ = ('latitude', 'longitude', 'size', 'mean_distance', 'max_distance')
+
+    def __init__(self, centres):
+        centres = Haversine.coordinates(centres)
+
+        self.latitude = centres[:, 0].copy()
+        self.longitude = centres[:, 1].copy()
+
+        self.size = np.zeros(len(centres), dtype=np.int32)
+        self.mean_distance = np.full(len(centres), np.nan)
+        self.max_distance = np.full(len(centres), np.nan)
+
+    def __len__(self) -> int:
+        return len(self.latitude)
+
+    @property
+    def centres(self) -> np.ndarray:
+        """ An (K, 2) array of (Lat, Long) centres indexed by cluster id """
+
+        return np.column_stack((self.latitude, self.longitude))
+
+    def locate(self, ids: np.ndarray) -> tuple:
+        """ (Latitude, Longitude) centre arrays per store - NaN for unplaced stores """
+
+        placed = ids >= 0
+
+        lat = np.full(len(ids), np.nan)
+        lon = np.full(len(ids), np.nan)
+
+        lat[placed] = self.latitude[ids[placed]]
+        lon[placed] = self.longitude[ids[placed]]
+
+        return (lat, lon)
+
+    def record(self, ids: np.ndarray, distances: np.ndarray):
+        """
+            Updates the member statistics from a store assignment
+
+            Args:
+                ids:        Cluster id per store (-1 for unplaced stores)
+                distances:  Distance from each store to its cluster centre
+
+            Returns:
+                The updated table
+        """
+
+        k = len(self)
+        finite = (ids >= 0) & np.isfinite(distances)
+
+        self.size = np.bincount(ids[finite], minlength=k).astype(np.int32)
+        totals = np.bincount(ids[finite], weights=distances[finite], minlength=k)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            self.mean_distance = totals / self.size
+
+        self.max_distance = np.full(k, np.nan)
+        np.fmax.at(self.max_distance, ids[finite], distances[finite])
+
+        return self
+
+    @classmethod
+    def centroids(cls, points, ids: np.ndarray):
+        """
+            Mean member position of every non-empty cluster
+
+            Args:
+                points: Store Latitude/Longitude points
+                ids:    Cluster id per store (-1 for unplaced stores)
+
+            Returns:
+                A ClusterTable of centroids - ids are renumbered densely in ascending order
+        """
+
+        coords = Haversine.coordinates(points)
+        placed = ids >= 0
+        finite = placed & np.isfinite(coords).all(axis=1)
+
+        members = np.bincount(ids[placed])
+        k = len(members)
+
+        counted = np.bincount(ids[finite], minlength=k)
+        lat = np.bincount(ids[finite], weights=coords[finite, 0], minlength=k)
+        lon = np.bincount(ids[finite], weights=coords[finite, 1], minlength=k)
+
+        keep = members > 0
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            centres = np.column_stack((lat[keep] / counted[keep], lon[keep] / counted[keep]))
+
+        return cls(centres)
+
+    @staticmethod
+    def movement(before, before_ids: np.ndarray, after, after_ids: np.ndarray) -> tuple:
+        """
+            Compares an assignment against the one its centroids were computed from
+
+            Args:
+                before:     Table the `before_ids` refer to
+                before_ids: Cluster id per store before re-assignment
+                after:      Centroid table (see `centroids`) the `after_ids` refer to
+                after_ids:  Cluster id per store after re-assignment
+
+            Returns:
+                (moved, shift) - the number of placed stores that changed cluster and the
+                largest centre movement in kilometers
+        """
+
+        # Centroid k was Computed from the k-th Non-Empty Cluster of the Previous Assignment
+        placed = (before_ids >= 0) & (after_ids >= 0)
+        origin = np.unique(before_ids[before_ids >= 0])
+
+        moved = int((origin[after_ids[placed]] != before_ids[placed]).sum())
+        shift = Haversine.paired(before.centres[origin], after.centres)
+
+        return (moved, float(np.nanmax(shift)) if len(shift) else 0.0)
+
+    def to_frame(self) -> pd.DataFrame:
+        return pd.DataFrame({
+            'Latitude': self.latitude,
+            'Longitude': self.longitude,
+            'Size': self.size,
+            'Mean Distance': self.mean_distance,
+            'Max Distance': self.max_distance
+        })
@@ -0,0 +1,248 @@
+import numpy as np
+import pandas as pd
+
+from .parallel import WorkerPool
+
+
+class Haversine():
+    """
+        Vectorized great-circle distances between arrays of Latitude/Longitude points
+
+        Points may be supplied as a single (Lat, Long) tuple, a list of tuples,
+        an (N, 2) array or a DataFrame containing Latitude and Longitude columns
+    """
+
+    # Earth's Radius in Kilometers (approximate)
+    radius: float = 6371.0
+
+    dtype = np.float64
+    block_size: int = 2048
+
+    # Centres Compared per Block by `nearest` (bounds the block at block_size x centre_block)
+    centre_block: int = 4096
+
+    @classmethod
+    def coordinates(cls, points, *, dtype=None) -> np.ndarray:
+        """
+            Normalizes a collection of points into an (N, 2) array
+
+            Args:
+                points: Tuple, list of tuples, array or DataFrame of Latitude/Longitude values
+                dtype:  Optional floating point precision (defaults to `Haversine.dtype`)
+
+            Returns:
+                An (N, 2) array of (Lat, Long) rows in degrees
+        """
+
+        dtype = dtype or cls.dtype
+
+        if isinstance(points, pd.DataFrame):
+            points = points[["Latitude", "Longitude"]].to_numpy()
+
+        array = np.asarray(points, dtype=dtype)
+
+        return array.reshape(-1, 2)
+
+    @classmethod
+    def _radians(cls, points, dtype) -> tuple:
+        array = np.radians(cls.coordinates(points, dtype=dtype))
+
+        lat = array[:, 0]
+        lon = array[:, 1]
+
+        return (lat, lon, np.cos(lat))
+
+    @classmethod
+    def _kernel(cls, lat1, lon1, cos1, lat2, lon2, cos2) -> np.ndarray:
+        # Haversine Formulae (inputs in radians, broadcastable)
+        a = (np.sin((lat2 - lat1) / 2) ** 2) + cos1 * cos2 * (np.sin((lon2 - lon1) / 2) ** 2)
+        a = np.clip(a, 0, 1)
+
+        c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+        return cls.radius * c
+
+    @classmethod
+    def between(cls, start: tuple, end: tuple) -> float:
+        """
+            Calculates the distance between two individual points
+
+            Args:
+                start:  Latitude/Longitude tuple for First Point (Lat, Long)
+                end:    Latitude/Longitude tuple for Second Point (Lat, Long)
+
+            Returns:
+                Float value representing the distance between the two points in kilometers
+        """
+
+        return float(cls.paired(start, end, dtype=np.float64)[0])
+
+    @classmethod
+    def one_to_many(cls, start: tuple, points, *, dtype=None) -> np.ndarray:
+        """
+            Calculates the distance from a single point to every point in a collection
+
+            Args:
+                start:  Latitude/Longitude tuple for the Starting Point
+                points: Collection of Latitude/Longitude points
+                dtype:  Optional floating point precision
+
+            Returns:
+                A 1-D array of distances in kilometers, aligned with `points`
+        """
+
+        dtype = dtype or cls.dtype
+
+        lat1, lon1, cos1 = cls._radians(start, dtype)
+        lat2, lon2, cos2 = cls._radians(points, dtype)
+
+        return cls._kernel(lat1, lon1, cos1, lat2, lon2, cos2)
+
+    @classmethod
+    def paired(cls, a, b, *, dtype=None) -> np.ndarray:
+        """
+            Calculates element-wise distances between two equally sized collections
+
+            Args:
+                a:      First collection of Latitude/Longitude points
+                b:      Second collection of Latitude/Longitude points
+                dtype:  Optional floating point precision
+
+            Returns:
+                A 1-D array where entry i is the distance between a[i] and b[i]
+        """
+
+        dtype = dtype or cls.dtype
+
+        lat1, lon1, cos1 = cls._radians(a, dtype)
+        lat2, lon2, cos2 = cls._radians(b, dtype)
+
+        return cls._kernel(lat1, lon1, cos1, lat2, lon2, cos2)
+
+    @classmethod
+    def blocks(cls, a, b=None, *, dtype=None, block_size: int = None):
+        """
+            Lazily calculates a many-to-many distance matrix in row blocks
+
+            Args:
+                a:          Collection of Latitude/Longitude points (rows)
+                b:          Optional collection of points (columns) - defaults to `a`
+                dtype:      Optional floating point precision
+                block_size: Number of rows calculated per block
+
+            Yields:
+                (start, stop, block) where block holds the distances for rows a[start:stop]
+        """
+
+        dtype = dtype or cls.dtype
+        block_size = block_size or cls.block_size
+
+        lat1, lon1, cos1 = cls._radians(a, dtype)
+
+        if b is None:
+            lat2, lon2, cos2 = lat1, lon1, cos1
+        else:
+            lat2, lon2, cos2 = cls._radians(b, dtype)
+
+        for start in range(0, len(lat1), block_size):
+            stop = min(start + block_size, len(lat1))
+
+            block = cls._kernel(
+                lat1[start:stop, None], lon1[start:stop, None], cos1[start:stop, None],
+                lat2[None, :], lon2[None, :], cos2[None, :]
+            )
+
+            yield (start, stop, block)
+
+    @classmethod
+    def many_to_many(cls, a, b=None, *, dtype=None, block_size: int = None) -> np.ndarray:
+        """
+            Calculates the full distance matrix between two collections of points
+
+            Args:
+                a:          Collection of Latitude/Longitude points (rows)
+                b:          Optional collection of points (columns) - defaults to `a`
+                dtype:      Optional floating point precision
+                block_size: Number of rows calculated per block
+
+            Returns:
+                An (N, M) array of distances in kilometers
+        """
+
+        dtype = dtype or cls.dtype
+
+        rows = len(cls.coordinates(a, dtype=dtype))
+        cols = rows if b is None else len(cls.coordinates(b, dtype=dtype))
+
+        matrix = np.empty((rows, cols), dtype=dtype)
+
+        for start, stop, block in cls.blocks(a, b, dtype=dtype, block_size=block_size):
+            matrix[start:stop] = block
+
+        return matrix
+
+    @staticmethod
+    def _nearest(shared: dict, task: tuple) -> tuple:
+        start, stop = task
+
+        points, centres = shared["points"][start:stop], shared["centres"]
+        rows = np.arange(stop - start)
+
+        closest = best = None
+
+        # Running Minimum over Centre Blocks - Strict Comparison keeps the First Minimum as argmin would
+        for lo in range(0, len(centres), Haversine.centre_block):
+            block = Haversine.many_to_many(points, centres[lo:lo + Haversine.centre_block])
+
+            indices = np.argmin(block, axis=1)
+            values = block[rows, indices]
+
+            if closest is None:
+                closest, best = indices + lo, values
+                continue
+
+            better = values < best
+            closest[better] = indices[better] + lo
+            best[better] = values[better]
+
+        # Points without Coordinates have no Closest Centre
+        closest[~np.isfinite(best)] = -1
+
+        return (start, stop, closest, best)
+
+    @classmethod
+    def nearest(cls, points, centres, *, workers: int = None, progress=None) -> tuple:
+        """
+            Locates the closest centre for every point in row blocks
+
+            Each row block is compared against `centre_block` centres at a time, so
+            memory stays bounded when there are many centres
+
+            Args:
+                points:     Collection of Latitude/Longitude points
+                centres:    Collection of candidate centre points
+                workers:    Optional worker process count (see `WorkerPool`)
+                progress:   Optional callback receiving the number of points processed
+
+            Returns:
+                (indices, distances) arrays holding the closest centre index and distance per point -
+                index -1 and a NaN distance for points without coordinates
+        """
+
+        points = cls.coordinates(points)
+        centres = cls.coordinates(centres)
+
+        closest = np.empty(len(points), dtype=np.int64)
+        distances = np.empty(len(points), dtype=cls.dtype)
+
+        tasks = WorkerPool.chunks(len(points), cls.block_size)
+        shared = {"points": points, "centres": centres}
+
+        for start, stop, indices, values in WorkerPool.map(cls._nearest, tasks, shared=shared, workers=workers):
+            closest[start:stop] = indices
+            distances[start:stop] = values
+
+            if progress is not None:
+                progress(stop - start)
+
+        return (closest, distances)
@@ -1,19 +1,78 @@
 import os
 import sys
+import json
+import time
 import requests
 
 import pandas as pd
 
+from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
 from .oauth2 import OAuth2
+from .odata import ODataQuery
+from .session import HTTPSession
 from ..types import class_property
 from ..secrets import SecretManager
 from ..logger import CustomLogger as log
 
 
+@dataclass
+class EntitySpec:
+    """ An entity set to download - `columns` maps Dynamics to local column names and doubles as the $select """
+
+    name: str
+    columns: dict
+    filters: tuple = ()
+
+    def query(self) -> ODataQuery:
+        return ODataQuery(self.name).select(*self.columns).where(*self.filters)
+
+
 class DynamicsConnector():
     token: str = None
     version: str = 'api/data/v9.2/'
 
+    # Records per Response Page (sent as `Prefer: odata.maxpagesize`)
+    page_size: int = 5000
+
+    # Entity Sets Downloaded Concurrently by `downloadEntities`
+    concurrency: int = 4
+
+    # Seconds Spent per Entity Set by the Last `downloadEntities` Call
+    timings: dict = {}
+
+    # Downloaded Columns (Dynamics Name -> Local Name) - also the server-side $select
+    columns = {
+        'accountnumber' : 'Account_Number',
+        'name': 'Account_Name',
+        'address1_line1': 'Street_Address',
+        'address1_city': 'City',
+        'new_stateorprovincename': 'State',
+        'new_countryname': 'Country',
+        'address1_postalcode': 'Postal_Code',
+        'new_storestatusname': 'Store_Status'
+    }
+
+    excluded_statuses = ['100000009', '100000006', '100000002', '100000001', '100000005', '100000008', 'null']
+
+    # Account Sync Strategy: 'full' re-downloads every account, 'modifiedon' requests accounts modified
+    # since the last run and 'changetracking' follows the Dynamics change-tracking delta token
+    sync_mode: str = 'full'
+
+    # Additional Columns required to merge Deltas into the Local Snapshot
+    sync_columns = {
+        'accountid': 'Account_ID',
+        'modifiedon': 'Modified_On',
+        'new_storestatus': 'Store_Status_Code'
+    }
+
+    snapshotfile = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'static', 'accounts.snapshot.csv')
+    syncfile = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'static', 'accounts.sync.json')
+
+    # Account Numbers Added, Modified or Removed by the Last Download (every account after a full download)
+    changed: set = None
+
     @class_property
     def header(cls):
         try:
@@ -29,7 +88,8 @@ class DynamicsConnector():
             'Accept': 'application/json',
             'Content-Type': 'application/json; charset=utf-8',
             'OData-MaxVersion': '4.0',
-            'OData-Version': '4.0'
+            'OData-Version': '4.0',
+            'Prefer': f'odata.maxpagesize={cls.page_size}'
         }
 
         return headers
@@ -38,34 +98,55 @@ class DynamicsConnector():
     @staticmethod
     def authenticate():
         log.state('Connecting to Dynamics 365 API...')
+        # Tokens are Cached by OAuth2 (see `TokenStore`) rather than Pinned to the Environment
+        # so Long Running Processes Refresh them before they Expire
         token = OAuth2.authorize()
 
-        os.environ['DynamicsToken'] = token
-
         return token
 
-    @staticmethod
-    def condense(table: pd.DataFrame) -> pd.DataFrame:
-        columns = {
-            'accountnumber' : 'Account_Number',
-            'name': 'Account_Name',
-            'address1_line1': 'Street_Address',
-            'address1_city': 'City',
-            'new_stateorprovincename': 'State',
-            'new_countryname': 'Country',
-            'address1_postalcode': 'Postal_Code',
-            'new_storestatusname': 'Store_Status'
-        }
+    @classmethod
+    def condense(cls, table: pd.DataFrame, columns: dict = None) -> pd.DataFrame:
+        columns = columns or cls.columns
 
         condensed = table.reindex(columns.keys(), axis=1)
         table = condensed.rename(columns=columns)
 
-        accountfilter = table[~table["Account_Number"].str.contains("LI0")]
+        return table
+
+    @classmethod
+    def applyFilters(cls, table: pd.DataFrame) -> pd.DataFrame:
+        """ Client-side equivalent of the server filters in `query`, for unfiltered delta responses """
+
+        excluded = [int(status) for status in cls.excluded_statuses if status.isdigit()]
 
-        return accountfilter
+        number = table['Account_Number']
+        status = pd.to_numeric(table['Store_Status_Code'], errors='coerce')
+
+        keep = (
+            number.notna()
+            & ~number.astype(str).str.contains('LI0', regex=False)
+            & status.notna()
+            & ~status.isin(excluded)
+        )
+
+        return table[keep]
 
     @classmethod
-    def getRequestEndpoint(cls, entity: str) -> str:
+    def query(cls, entity: str) -> ODataQuery:
+        """ Builds the default account query with projection and filters pushed to the server """
+
+        query = (
+            ODataQuery(entity)
+            .select(*cls.columns.keys())
+            .where('accountnumber ne null')
+            .exclude('new_storestatus', cls.excluded_statuses)
+            .excludeContaining('accountnumber', 'LI0')
+        )
+
+        return query
+
+    @classmethod
+    def getRequestEndpoint(cls, entity: str, query: ODataQuery = None) -> str:
         base = SecretManager.DynamicsEndpoint
 
         if not base:
@@ -73,43 +154,261 @@ class DynamicsConnector():
             
             return sys.exit()
 
-        _filter = ' and new_storestatus ne '
-        excluded = ['100000009', '100000006', '100000002', '100000001', '100000005', '100000008', 'null']
-        filter = '?$filter=accountnumber ne null' + _filter + _filter.join(excluded)
+        query = query or cls.query(entity)
            
-        return base + cls.version + entity + filter
+        return query.build(base + cls.version)
     
     
     @classmethod
-    def _download(cls):
+    def _responses(cls, url: str, header: dict):
+        """
+            Streams an entity set one response page at a time, following `@odata.nextLink`
+
+            Args:
+                url:    Initial request endpoint
+                header: Request headers
+
+            Yields:
+                The decoded JSON body of each response page
+        """
+
+        page = 1
+
+        while url:
+            log.debug(f'Requesting Page {page}...')
+
+            try:
+                response = HTTPSession.get(url, headers=header)
+                data = response.json()
+
+            except (requests.RequestException, ValueError) as error:
+                log.fatal(f'Request Failed ({error}) - Terminating...')
+
+                return sys.exit()
+
+            if 'value' not in data:
+                log.fatal('Malformed Response - Terminating...')
+
+                return sys.exit()
+
+            yield data
+
+            url = data.get('@odata.nextLink')
+            page += 1
+
+    @classmethod
+    def _pages(cls, url: str, header: dict, columns: dict = None):
+        """ Yields a condensed DataFrame per response page (see `_responses`) """
+
+        for data in cls._responses(url, header):
+            yield cls.condense(pd.json_normalize(data, 'value'), columns)
+
+    @classmethod
+    def _fetch(cls, spec: EntitySpec, header: dict) -> tuple:
+        start = time.perf_counter()
+
+        url = cls.getRequestEndpoint(spec.name, spec.query())
+        pages = list(cls._pages(url, header, spec.columns))
+
+        table = pd.concat(pages, ignore_index=True)
+
+        return (table, len(pages), time.perf_counter() - start)
+
+    @classmethod
+    @log.span('download.entities')
+    def downloadEntities(cls, specs: list, *, concurrency: int = None) -> dict:
+        """
+            Downloads several entity sets concurrently over the shared HTTP session
+
+            Each entity set is paged independently; `timings` records the seconds spent on each
+
+            Args:
+                specs:          EntitySpec per entity set
+                concurrency:    Optional number of entity sets requested at once (defaults to `concurrency`)
+
+            Returns:
+                A dictionary mapping each entity set name to its condensed DataFrame
+        """
+
         header = cls.header
+        concurrency = concurrency or cls.concurrency
+
+        tables = {}
+        cls.timings = {}
+
+        log.state(f'Requesting {len(specs)} Entity Sets ({", ".join(spec.name for spec in specs)})...')
+
+        with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(specs)))) as executor:
+            futures = {executor.submit(cls._fetch, spec, header): spec for spec in specs}
+
+            for future in as_completed(futures):
+                spec = futures[future]
+                table, pages, seconds = future.result()
 
+                tables[spec.name] = table
+                cls.timings[spec.name] = seconds
+
+                log.debug(f'Downloaded [{spec.name}]: {len(table)} Rows in {pages} Pages ({seconds:.2f}s)')
+
+        return {spec.name: tables[spec.name] for spec in specs}
+
+    @classmethod
+    def _download(cls):
         log.state('Requesting [dbo.Accounts] Table...')
-        url = cls.getRequestEndpoint('accounts')
-        response = requests.get(url, headers=header)
+        spec = EntitySpec('accounts', cls.columns, tuple(cls.query('accounts').clauses))
 
-        log.state('Loading Response into Data Frame...')
-        data = response.json()
-        
-        try:
-            _table = pd.json_normalize(data, 'value')
+        table = cls.downloadEntities([spec])['accounts']
 
-        except KeyError:
-            log.fatal('Malformed Response - Terminating...')
-            
-            return sys.exit()
+        cls.changed = set(table['Account_Number'])
+
+        return table
+
+    @classmethod
+    def loadState(cls) -> tuple:
+        """ Reads the local account snapshot and sync state, returning (None, {}) when either is missing """
+
+        if not (os.path.exists(cls.snapshotfile) and os.path.exists(cls.syncfile)):
+            return (None, {})
+
+        with open(cls.syncfile) as file:
+            state = json.load(file)
+
+        marker = 'deltaLink' if cls.sync_mode == 'changetracking' else 'watermark'
+
+        if state.get('mode') != cls.sync_mode or not state.get(marker):
+            return (None, {})
+
+        snapshot = pd.read_csv(cls.snapshotfile, dtype=str)
+        snapshot = snapshot.astype(object).where(snapshot.notna(), None)
+
+        return (snapshot, state)
+
+    @classmethod
+    def saveState(cls, snapshot: pd.DataFrame, state: dict) -> None:
+        os.makedirs(os.path.dirname(cls.snapshotfile), exist_ok=True)
+
+        snapshot.to_csv(cls.snapshotfile, index=False)
+
+        with open(cls.syncfile, 'w') as file:
+            json.dump({'mode': cls.sync_mode, **state}, file, indent=4)
+
+        return
+
+    @classmethod
+    def merge(cls, snapshot: pd.DataFrame, changes: pd.DataFrame, deleted: set) -> tuple:
+        """
+            Upserts changed accounts into the snapshot by Account_ID and drops deleted ones
+
+            Changed records that no longer pass `applyFilters` (e.g. a status change to an
+            excluded status) are removed from the snapshot
+
+            Args:
+                snapshot:   Current local accounts (downloaded and sync columns)
+                changes:    Records modified since the last sync
+                deleted:    Account_IDs deleted since the last sync
+
+            Returns:
+                (snapshot, changed) where changed holds the Account Numbers added, modified or removed
+        """
+
+        changes = changes.drop_duplicates('Account_ID', keep='last')
+        changes = changes[~changes['Account_ID'].isin(deleted)]
+        touched = snapshot['Account_ID'].isin(set(changes['Account_ID']) | set(deleted))
+
+        previous = snapshot[touched]
+        upserted = cls.applyFilters(changes)
+
+        merged = pd.concat([snapshot[~touched], upserted], ignore_index=True)
+
+        # Records re-sent without changes to any Downloaded Column are not Reported
+        fields = list(cls.columns.values())
+
+        before = set(previous[fields].fillna('').astype(str).itertuples(index=False, name=None))
+        after = upserted[fields].fillna('').astype(str).itertuples(index=False, name=None)
+
+        changed = {row[0] for row in after if row not in before}
+        changed |= set(previous['Account_Number']) - set(upserted['Account_Number'])
+
+        return (merged, changed)
+
+    @classmethod
+    def _sync(cls):
+        """
+            Downloads accounts changed since the last run and merges them into the local snapshot
+
+            The high-water mark is either the latest `modifiedon` value seen ('modifiedon') or the
+            `@odata.deltaLink` returned by Dynamics change tracking ('changetracking'). Hard deletes
+            are only reported by change tracking
+        """
+
+        header = cls.header
+        columns = {**cls.columns, **cls.sync_columns}
+
+        snapshot, state = cls.loadState()
+        tracking = cls.sync_mode == 'changetracking'
+
+        if tracking:
+            header['Prefer'] = f'odata.track-changes,odata.maxpagesize={cls.page_size}'
+
+        if snapshot is None:
+            log.state('No Account Snapshot Found - Requesting Initial [dbo.Accounts] Table...')
+
+            # Change Tracking Requests do not Support $filter - Filters are Applied Locally
+            query = ODataQuery('accounts').select(*columns) if tracking else cls.query('accounts').select(*cls.sync_columns)
+            url = cls.getRequestEndpoint('accounts', query)
+
+            snapshot = pd.DataFrame(columns=list(columns.values()))
+
+        elif tracking:
+            log.state('Requesting [dbo.Accounts] Changes since Last Sync...')
+            url = state['deltaLink']
+
+        else:
+            log.state(f'Requesting [dbo.Accounts] Changes since {state["watermark"]}...')
+            query = ODataQuery('accounts').select(*columns).where(f'modifiedon ge {state["watermark"]}')
+            url = cls.getRequestEndpoint('accounts', query)
+
+        pages = []
+        deleted = set()
+
+        for data in cls._responses(url, header):
+            records = []
+
+            for record in data['value']:
+                if '$deletedEntity' in record.get('@odata.context', ''):
+                    deleted.add(record['id'])
+                else:
+                    records.append(record)
+
+            pages.append(cls.condense(pd.json_normalize(records), columns))
+
+            if tracking:
+                state['deltaLink'] = data.get('@odata.deltaLink', state.get('deltaLink'))
+
+        changes = pd.concat(pages, ignore_index=True)
+        log.debug(f'Received {len(changes)} Changed and {len(deleted)} Deleted Accounts')
+
+        snapshot, cls.changed = cls.merge(snapshot, changes, deleted)
+        log.debug(f'{len(cls.changed)} Accounts Changed | {len(snapshot)} Accounts in Snapshot')
+
+        if not tracking and len(changes):
+            state['watermark'] = max(filter(None, [state.get('watermark'), *changes['Modified_On'].dropna()]))
+
+        cls.saveState(snapshot, state)
 
+        table = snapshot.reindex(cls.columns.values(), axis=1)
 
-        log.debug('Condensing Table...')
-        table = cls.condense(_table)
-        
         return table
 
 
 class DynamicsEngine(DynamicsConnector):
 
     @classmethod
+    @log.span('download')
     def download(cls):
-        data = super()._download()
+        if cls.sync_mode == 'full':
+            data = super()._download()
+        else:
+            data = super()._sync()
 
         return data
\ No newline at end of file
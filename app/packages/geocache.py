@@ -0,0 +1,120 @@
+import os
+import re
+import time
+import sqlite3
+
+from ..logger import CustomLogger as log
+
+
+class GeocodeCache():
+    """
+        Persistent SQLite cache of geocoded addresses
+
+        Entries are keyed by a normalized address and store the coordinates,
+        the provider that resolved them and when they were resolved. Entries
+        older than `ttl_days` are treated as misses and re-geocoded
+    """
+
+    path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'static', 'geocode.db')
+
+    ttl_days: float = 90
+
+    # SQLite Host Parameter Limit per Query
+    batch_size: int = 500
+
+    @staticmethod
+    def normalize(address: str) -> str:
+        """ Lower-cases an address, strips punctuation and drops empty (None / NaN) components """
+
+        tokens = re.sub(r'[^\w\s]', ' ', str(address).lower()).split()
+
+        return ' '.join(token for token in tokens if token not in ('none', 'nan'))
+
+    @classmethod
+    def connect(cls) -> sqlite3.Connection:
+        os.makedirs(os.path.dirname(cls.path), exist_ok=True)
+
+        connection = sqlite3.connect(cls.path)
+        connection.execute(
+            '''
+                CREATE TABLE IF NOT EXISTS geocodes (
+                    address TEXT PRIMARY KEY,
+                    latitude REAL NOT NULL,
+                    longitude REAL NOT NULL,
+                    provider TEXT NOT NULL,
+                    timestamp REAL NOT NULL
+                )
+            '''
+        )
+
+        return connection
+
+    @classmethod
+    def lookup(cls, addresses: list) -> dict:
+        """
+            Retrieves unexpired coordinates for a collection of normalized addresses
+
+            Args:
+                addresses: Normalized address keys
+
+            Returns:
+                A dictionary mapping each cached address to a (Lat, Long) tuple
+        """
+
+        addresses = list(addresses)
+        expiry = time.time() - cls.ttl_days * 86400
+
+        found = {}
+
+        with cls.connect() as connection:
+            for start in range(0, len(addresses), cls.batch_size):
+                batch = addresses[start:start + cls.batch_size]
+                params = ', '.join('?' for _ in batch)
+
+                rows = connection.execute(
+                    f'SELECT address, latitude, longitude FROM geocodes WHERE timestamp >= ? AND address IN ({params})',
+                    [expiry, *batch]
+                )
+
+                found.update({address: (lat, lon) for address, lat, lon in rows})
+
+        connection.close()
+
+        return found
+
+    @classmethod
+    def store(cls, coordinates: dict, *, provider: str) -> None:
+        """
+            Saves (or refreshes) geocoding results
+
+            Args:
+                coordinates:    A dictionary mapping normalized addresses to (Lat, Long) tuples
+                provider:       Name of the geocoding provider that resolved them
+        """
+
+        now = time.time()
+
+        with cls.connect() as connection:
+            connection.executemany(
+                'INSERT OR REPLACE INTO geocodes (address, latitude, longitude, provider, timestamp) VALUES (?, ?, ?, ?, ?)',
+                [(address, lat, lon, provider, now) for address, (lat, lon) in coordinates.items()]
+            )
+
+        connection.close()
+
+        log.debug(f'Cached {len(coordinates)} Geocoding Results')
+
+        return
+
+    @classmethod
+    def purge(cls) -> int:
+        """ Deletes expired entries and returns the number removed """
+
+        expiry = time.time() - cls.ttl_days * 86400
+
+        with cls.connect() as connection:
+            removed = connection.execute('DELETE FROM geocodes WHERE timestamp < ?', [expiry]).rowcount
+
+        connection.close()
+
+        return removed
@@ -1,10 +1,18 @@
 import os
+import time
 
+import numpy as np
 import pandas as pd
 import tqdm as tqdm
 
 from geopy import Bing
+from geopy.exc import GeocoderServiceError, GeocoderTimedOut, GeocoderUnavailable, GeocoderRateLimited
 
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from .ratelimit import TokenBucket
+from .geocache import GeocodeCache
+from .artifacts import Artifacts
 from ..secrets import SecretManager
 from ..logger import CustomLogger as log
 
@@ -13,12 +21,20 @@ class LocationEngine():
 
     geocoder = Bing(api_key=SecretManager.BingMapsAPI)
 
+    # Resolve Addresses through the Persistent Geocode Cache before the Network
+    use_cache: bool = True
+
+    # Concurrent Requests, Provider Queries per Second and Retry Policy for Transient Failures
+    concurrency: int = 1
+    rate_limit: float = 5.0
+    retries: int = 3
+    backoff: float = 1.0
+
+    transient = (GeocoderTimedOut, GeocoderUnavailable, GeocoderRateLimited)
+
+    # Resolved Addresses Handed to `lookup`'s Callback at a Time (Cached as the Run Progresses)
+    batch_size: int = 100
 
-    savefile = os.path.abspath(__file__).replace('geocode.py', 'static/coordinates.csv')
-    
-    
-    savefile = os.path.abspath(__file__).replace('geocode.py', 'static/coordinates.csv')
-    
     @staticmethod
     def format_table(data: pd.DataFrame):
         def create_address(x):
@@ -33,18 +49,186 @@ class LocationEngine():
 
         return data
 
+    @staticmethod
+    def _coordinates(location) -> tuple:
+        if location is None:
+            return (np.nan, np.nan)
+
+        return (location.latitude, location.longitude)
+
     @classmethod
-    def geocode(cls, data: pd.DataFrame) -> pd.DataFrame:
+    def _resolve(cls, address: str, limiter: TokenBucket):
+        for attempt in range(cls.retries + 1):
+            limiter.acquire()
+
+            try:
+                return cls.geocoder.geocode(address)
+
+            except cls.transient as error:
+                if attempt == cls.retries:
+                    log.issue(f'Geocoding Failed after {attempt + 1} Attempts: {address} | {error}')
+
+                    return None
+
+                delay = cls.backoff * (2 ** attempt)
+
+                if isinstance(error, GeocoderRateLimited) and error.retry_after:
+                    delay = max(delay, error.retry_after)
+
+                log.trace(f'Retrying Geocode in {delay:.1f}s: {address} | {error}')
+                time.sleep(delay)
+
+            # Rejected Queries, Quota and Authentication Errors are not Retried - the Address is Skipped
+            except GeocoderServiceError as error:
+                log.issue(f'Geocoding Failed: {address} | {type(error).__name__}: {error}')
+
+                return None
+
+    @classmethod
+    def lookup(cls, addresses: list, *, completed=None) -> list:
+        """
+            Geocodes a list of addresses, optionally across concurrent requests
+
+            Requests share a token bucket limited to `rate_limit` queries per second
+            and transient provider failures are retried with exponential backoff
+
+            Args:
+                addresses:  Composite address strings
+                completed:  Optional callback receiving a {position: (Lat, Long)} dictionary
+                            every `batch_size` resolved addresses (and once more for the
+                            remainder, even if the run is interrupted)
+
+            Returns:
+                A list of (Lat, Long) tuples in the same order as `addresses`
+        """
+
+        limiter = TokenBucket(cls.rate_limit)
+        located = [(np.nan, np.nan)] * len(addresses)
+        batch = {}
+
+        def finish(i: int, location) -> None:
+            located[i] = cls._coordinates(location)
+
+            if location is not None:
+                batch[i] = located[i]
+
+            if completed is not None and len(batch) >= cls.batch_size:
+                completed(dict(batch))
+                batch.clear()
+
+        with tqdm.tqdm(total=len(addresses), desc='Fetching Coordinates...', colour='GREEN', leave=True, position=0) as pbar:
+            try:
+                if cls.concurrency <= 1:
+                    for i, address in enumerate(addresses):
+                        finish(i, cls._resolve(address, limiter))
+                        pbar.update(1)
+
+                else:
+                    with ThreadPoolExecutor(max_workers=cls.concurrency) as executor:
+                        futures = {
+                            executor.submit(cls._resolve, address, limiter): i
+                            for i, address in enumerate(addresses)
+                        }
+
+                        for future in as_completed(futures):
+                            finish(futures[future], future.result())
+                            pbar.update(1)
+
+            finally:
+                if completed is not None and batch:
+                    completed(dict(batch))
+
+        return located
+
+    @classmethod
+    def previous(cls, changed: set) -> dict:
+        """ Coordinates saved by the last run for every account not in `changed` """
+
+        path = Artifacts.path('coordinates')
+
+        if changed is None or not os.path.exists(path):
+            return {}
+
+        saved = Artifacts.read(path)
+        saved = saved.dropna(subset=['Latitude', 'Longitude'])
+        saved = saved[~saved['Account_Number'].isin(changed)]
+
+        return dict(zip(saved['Account_Number'], zip(saved['Latitude'], saved['Longitude'])))
+
+    @classmethod
+    @log.span('geocode')
+    def geocode(cls, data: pd.DataFrame, *, changed: set = None) -> pd.DataFrame:
+        """
+            Resolves coordinates for every account
+
+            Args:
+                data:       Downloaded accounts
+                changed:    Optional Account Numbers changed since the last run - every other
+                            account reuses its previously saved coordinates
+
+            Returns:
+                The accounts with Coordinates, Latitude and Longitude columns
+        """
+
         log.state('Creating Composite Index for Address Search...')
-        table = cls.format_table(data)
 
-        log.state('Applying Geocoding Software...')
-        print()
+        # Pending Addresses are Looked up by Label - a Unique Index keeps them Aligned with their Keys
+        table = cls.format_table(data.reset_index(drop=True))
+        keys = table['Address'].map(GeocodeCache.normalize)
+
+        reused = cls.previous(changed)
+        stale = ~table['Account_Number'].isin(list(reused))
+
+        if reused:
+            log.debug(f'Reusing Coordinates for {len(table) - int(stale.sum())} Unchanged Accounts')
+
+        # Each Unique Address is only Resolved Once and Broadcast back to every Account
+        unique = keys[stale].drop_duplicates()
+        log.debug(
+            f'Deduplicated {int(stale.sum())} Accounts to {len(unique)} Unique Addresses '
+            f'(Dedupe Ratio: {1 - len(unique) / max(int(stale.sum()), 1):.1%})'
+        )
+
+        cached = GeocodeCache.lookup(unique.tolist()) if cls.use_cache else {}
+        misses = ~unique.isin(list(cached))
+
+        log.debug(f'Geocode Cache: {int((~misses).sum())} Hits | {int(misses.sum())} Misses')
+
+        if misses.any():
+            log.state('Applying Geocoding Software...')
+            print()
+
+            pending = unique[misses].tolist()
+            addresses = table.loc[unique[misses].index, 'Address'].tolist()
+
+            # Results are Cached as they Arrive, so a Failure late in a Long Run keeps Earlier Work
+            def store(batch: dict) -> None:
+                GeocodeCache.store(
+                    {pending[i]: coordinates for i, coordinates in batch.items()},
+                    provider=type(cls.geocoder).__name__
+                )
+
+            located = cls.lookup(addresses, completed=store if cls.use_cache else None)
+            print()
+
+            resolved = {
+                key: coordinates
+                for key, coordinates in zip(pending, located)
+                if not np.isnan(coordinates).any()
+            }
+
+            failed = len(pending) - len(resolved)
+
+            if failed:
+                log.issue(f'Unable to Geocode {failed} Addresses')
+
+            cached.update(resolved)
 
-        tqdm.tqdm.pandas(desc='Fetching Coordinates...', colour='GREEN', leave=True, position=0)
-        table['Coordinates'] = table['Address'].progress_apply(cls.geocoder.geocode).apply(lambda x: (x.latitude, x.longitude))
+        table['Coordinates'] = [
+            reused.get(number) or cached.get(key, (np.nan, np.nan))
+            for number, key in zip(table['Account_Number'], keys)
+        ]
         table[['Latitude', 'Longitude']] = table['Coordinates'].apply(lambda x: pd.Series(x))
-        print()
 
         columns = ['Account_Number', 'Account_Name', 'Store_Status', 'Coordinates', 'Latitude', 'Longitude']
         geocoded = table.reindex(columns, axis=1)
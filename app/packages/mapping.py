@@ -1,10 +1,18 @@
 import os
+import json
 import folium
+import hashlib
 import random
+import shutil
+import shapely
 
+import numpy as np
 import pandas as pd
 import geopandas as gpd
 
+from folium.plugins import FastMarkerCluster
+
+from .artifacts import Artifacts
 from ..logger import CustomLogger as log
 
 
@@ -12,8 +20,60 @@ class MappingEngine():
 
     map_center = [45, -100]
 
-    mapfile = os.path.abspath(__file__).replace('packages\\mapping.py', 'static\\map.html')
-    clusterfile = os.path.abspath(__file__).replace('packages\\mapping.py', 'static\\clusters.csv')
+    mapfile = os.path.join(Artifacts.directory, 'map.html')
+
+    # 'fast' emits every store through one FastMarkerCluster layer built in the browser,
+    # 'markers' emits one folium.Marker per store (large HTML - small datasets only)
+    render_mode: str = 'fast'
+
+    # Zoom Level from which Stores are Drawn Individually rather than Grouped
+    cluster_zoom: int = 7
+
+    exportdir = os.path.join(Artifacts.directory, 'export')
+
+    # Whole-Layer Formats Written by `export` ('geojson', 'flatgeobuf') and the Zoom Levels Pre-Tiled
+    export_formats: tuple = ('geojson',)
+    tile_zooms: tuple = tuple(range(4, 10))
+
+    # Decimal Places Kept in Exported Coordinates (6 ~ 0.1 m)
+    precision: int = 6
+
+    # Territory Hulls: 'convex' or 'concave' (`concave_ratio` from 0 = Tightest to 1 = Convex)
+    hull_method: str = 'convex'
+    concave_ratio: float = 0.3
+
+    # Hull Simplification Tolerance per Zoom Level, in Screen Pixels of a 256px Tile
+    simplify_pixels: float = 1.0
+
+    # Draw Territory Hulls on the Cluster Map (simplified for `cluster_zoom`)
+    show_hulls: bool = True
+
+    # Hulls Cached by Territory Membership Hash
+    hullfile = os.path.join(Artifacts.directory, 'hulls.json')
+
+    # Store Markers are Built Client-Side from Compact Rows:
+    # [Lat, Long, Account Number, Account Name, Neighbors, Density, Territory, Territory Size, Colour, Centre]
+    callback = """
+        var callback = function (row) {
+            var marker = L.circleMarker(new L.LatLng(row[0], row[1]), {
+                radius: row[9] ? 7 : 4,
+                color: row[9] ? 'red' : row[8],
+                fillColor: row[8],
+                fillOpacity: 0.8,
+                weight: row[9] ? 3 : 1
+            });
+
+            marker.bindTooltip(
+                'Store: ' + row[2] + ' | ' + row[3] +
+                '<br>Stores Within Range: ' + row[4] +
+                '<br>Avg Travel Distance: ' + row[5] +
+                '<br>Territory: ' + row[6] +
+                '<br>Territory Size: ' + row[7]
+            );
+
+            return marker;
+        };
+    """
 
     @staticmethod
     def convert(df: pd.DataFrame):
@@ -26,56 +86,367 @@ class MappingEngine():
         )
 
         return geo
-    
+
+    @staticmethod
+    def territories(df: pd.DataFrame) -> tuple:
+        """
+            Resolves each store's territory and its size in one pass
+
+            Args:
+                df: Clustered stores (from either cluster engine)
+
+            Returns:
+                (ids, centres, sizes) - dense territory index per store, the (K, 2) centre
+                array and the number of placed stores in each territory
+        """
+
+        # Both Engines' Spellings of the Centre Columns are Accepted
+        centre = 'Cluster Centre' if 'Cluster Centre' in df else 'Cluster Center'
+
+        if 'Cluster Latitude' in df and 'Cluster Longitude' in df:
+            points = df[['Cluster Latitude', 'Cluster Longitude']].to_numpy(dtype=float)
+        else:
+            points = np.asarray(df[centre].tolist(), dtype=float).reshape(-1, 2)
+
+        centres, ids = np.unique(points, axis=0, return_inverse=True)
+        ids = ids.reshape(-1)
+
+        # Stores without Coordinates belong to no Territory
+        placed = np.isfinite(df[['Latitude', 'Longitude']].to_numpy(dtype=float)).all(axis=1)
+
+        return (ids, centres, np.bincount(ids[placed], minlength=len(centres)))
+
+    @staticmethod
+    def colormap(size: int) -> list:
+        return ['#' + ''.join(random.choice("ABCDEF0123456789") for _ in range(6)) for _ in range(size)]
+
     @classmethod
+    def rows(cls, df: pd.DataFrame, ids: np.ndarray, centres: np.ndarray, sizes: np.ndarray, colors: list) -> list:
+        """ Compact per-store rows consumed by `callback` """
+
+        density = 'Relative Density' if 'Relative Density' in df else 'Total Density'
+
+        lat = df['Latitude'].to_numpy(dtype=float)
+        lon = df['Longitude'].to_numpy(dtype=float)
+
+        is_centre = (lat == centres[ids, 0]) & (lon == centres[ids, 1])
+        territory = [f'({a:.5f}, {b:.5f})' for a, b in centres.tolist()]
+
+        table = pd.DataFrame({
+            'lat': lat,
+            'lon': lon,
+            'number': df['Account_Number'].astype(str).to_numpy(),
+            'name': df['Account_Name'].astype(str).to_numpy(),
+            'neighbors': df['Neighbors'].to_numpy() if 'Neighbors' in df else '',
+            'density': df[density].round(2).to_numpy() if density in df else '',
+            'territory': np.asarray(territory, dtype=object)[ids],
+            'size': sizes[ids],
+            'color': np.asarray(colors, dtype=object)[ids],
+            'centre': is_centre.astype(int)
+        })
+
+        # Stores without Coordinates cannot be Placed
+        table = table[np.isfinite(lat) & np.isfinite(lon)]
+
+        return table.to_numpy().tolist()
+
+    @classmethod
+    @log.span('map')
     def map(cls, df: pd.DataFrame = None):
         log.state('Creating Cluster Map...')
         if df is None:
-            df = pd.read_csv(cls.clusterfile)
-        
-        geo = cls.convert(df)
-
-        def colormap(df: pd.DataFrame):
-            clusters = df["Cluster Centre"].unique()
-            colors = {cluster: '#' + ''.join([random.choice("ABCDEF0123456789") for _ in range(6)]) for cluster in clusters}
+            df = Artifacts.read(Artifacts.path('clusters'))
 
-            return colors
+        ids, centres, sizes = cls.territories(df)
+        colors = cls.colormap(len(centres))
 
         map = folium.Map(location=cls.map_center, zoom_start=4)
 
-        colors = colormap(geo)
-        
-        for idx, row in geo.iterrows():
-            log.trace(f'Adding Marker for Row {idx} - {row["Account_Number"]} | {row["Account_Name"]}')
-            
-            tooltip = f'''
-                Store: {row["Account_Number"]} | {row["Account_Name"]}
-                Stores Within Range: {row["Neighbors"]}
-                Avg Travel Distance: {row["Relative Density"]}
-                Territory: {row["Cluster Centre"]}
-                Territory Size: {len(df[df["Cluster Center"] == row["Cluster Centre"]])}
-            '''
-
-            if (row["Latitude"], row["Longitude"]) == row["Cluster Centre"]:
-                background = "red"
-            else:
-                background = "gray"
+        if cls.render_mode == 'fast':
+            log.debug(f'Rendering {len(df)} Stores in {len(centres)} Territories...')
 
-            folium.Marker(
-                location = [row['Latitude'], row['Longitude']],
-                tooltip = tooltip,
-                icon = folium.Icon(icon='circle', prefix='fa', icon_color=colors[row['Cluster Centre']], color=background)
+            FastMarkerCluster(
+                cls.rows(df, ids, centres, sizes, colors),
+                callback=cls.callback,
+                name='Stores',
+                disableClusteringAtZoom=cls.cluster_zoom,
+                chunkedLoading=True
             ).add_to(map)
-        
-        centroids = geo["Cluster Center"].unique()
-        for centroid in centroids:
+
+        else:
+            # Stores without Coordinates cannot be Placed - `placed` keeps their Territory Ids Aligned
+            placed = np.isfinite(df['Latitude'].to_numpy(dtype=float)) & np.isfinite(df['Longitude'].to_numpy(dtype=float))
+            geo = cls.convert(df[placed])
+
+            for territory, (idx, row) in zip(ids[placed], geo.iterrows()):
+                log.trace(f'Adding Marker for Row {idx} - {row["Account_Number"]} | {row["Account_Name"]}')
+
+                tooltip = f'''
+                    Store: {row["Account_Number"]} | {row["Account_Name"]}
+                    Stores Within Range: {row.get("Neighbors")}
+                    Avg Travel Distance: {row.get("Relative Density", row.get("Total Density"))}
+                    Territory: {tuple(centres[territory])}
+                    Territory Size: {sizes[territory]}
+                '''
+
+                if (row["Latitude"], row["Longitude"]) == tuple(centres[territory]):
+                    background = "red"
+                else:
+                    background = "gray"
+
+                folium.Marker(
+                    location = [row['Latitude'], row['Longitude']],
+                    tooltip = tooltip,
+                    icon = folium.Icon(icon='circle', prefix='fa', icon_color=colors[territory], color=background)
+                ).add_to(map)
+
+        if cls.show_hulls:
+            _, territories = cls.layers(df)
+
+            folium.GeoJson(
+                cls.simplified(territories, cls.cluster_zoom),
+                name='Territories',
+                style_function=lambda feature: {
+                    'color': colors[feature['properties']['Territory']],
+                    'fillColor': colors[feature['properties']['Territory']],
+                    'weight': 2,
+                    'fillOpacity': 0.15
+                },
+                tooltip=folium.GeoJsonTooltip(fields=['Territory', 'Size'])
+            ).add_to(map)
+
+        for territory, centroid in enumerate(centres.tolist()):
+            if not np.isfinite(centroid).all():
+                continue
+
             folium.Marker(
                 location = centroid,
                 popup=None,
-                icon = folium.Icon(color="red", icon_color=colors[centroid], icon="circle", prefix="fa")
+                tooltip = f'Territory Size: {sizes[territory]}',
+                icon = folium.Icon(color="red", icon_color=colors[territory], icon="circle", prefix="fa")
             ).add_to(map)
 
-        
+
         return map
 
-        
+    @classmethod
+    def layers(cls, df: pd.DataFrame) -> tuple:
+        """
+            Builds the exported store and territory layers
+
+            Args:
+                df: Clustered stores (from either cluster engine)
+
+            Returns:
+                (stores, territories) GeoDataFrames - store points tagged with their territory
+                and one hull polygon per territory (see `hulls`)
+        """
+
+        ids, centres, sizes = cls.territories(df)
+        placed = np.isfinite(df['Latitude'].to_numpy(dtype=float)) & np.isfinite(df['Longitude'].to_numpy(dtype=float))
+
+        points = df.loc[placed, ['Account_Number', 'Account_Name', 'Latitude', 'Longitude']].round({
+            'Latitude': cls.precision,
+            'Longitude': cls.precision
+        })
+        points['Territory'] = ids[placed]
+
+        stores = cls.convert(points.reset_index(drop=True))
+
+        territories = gpd.GeoDataFrame(geometry=cls.hulls(stores))
+        territories.index.name = 'Territory'
+
+        territories['Size'] = sizes[territories.index]
+        territories['Centre Latitude'] = centres[territories.index, 0].round(cls.precision)
+        territories['Centre Longitude'] = centres[territories.index, 1].round(cls.precision)
+
+        return (stores, territories.reset_index())
+
+    @classmethod
+    def hulls(cls, stores: gpd.GeoDataFrame) -> gpd.GeoSeries:
+        """
+            Computes a hull polygon per territory in one dissolve pass
+
+            Hulls are cached in `hullfile` under a hash of the territory's members and
+            their coordinates, so only territories whose membership changed are recomputed
+
+            Args:
+                stores: Store points with a Territory column (see `layers`)
+
+            Returns:
+                A GeoSeries of hulls indexed by territory
+        """
+
+        setting = f'{cls.hull_method}:{cls.concave_ratio if cls.hull_method == "concave" else ""}:{cls.precision}'
+
+        rows = pd.util.hash_pandas_object(stores[['Account_Number', 'Latitude', 'Longitude']], index=False).to_numpy()
+        territory = stores['Territory'].to_numpy()
+
+        # Members are Ordered by Row Hash so the Key does not Depend on Row Order
+        order = np.lexsort((rows, territory))
+        groups = np.split(order, np.flatnonzero(np.diff(territory[order])) + 1) if len(order) else []
+
+        keys = {
+            int(territory[group[0]]): hashlib.sha1(setting.encode() + rows[group].tobytes()).hexdigest()
+            for group in groups
+        }
+
+        cache = {}
+
+        if os.path.exists(cls.hullfile):
+            try:
+                with open(cls.hullfile) as file:
+                    cache = json.load(file)
+
+            except (OSError, ValueError):
+                log.issue(f'Unable to Read Hull Cache - Recomputing every Territory: {cls.hullfile}')
+
+            if not isinstance(cache, dict):
+                cache = {}
+
+        missing = [key for key in keys if keys[key] not in cache]
+
+        if missing:
+            merged = stores[stores['Territory'].isin(missing)][['Territory', 'geometry']].dissolve(by='Territory').geometry
+
+            if cls.hull_method == 'concave':
+                shapes = shapely.concave_hull(merged.values, ratio=cls.concave_ratio)
+            else:
+                shapes = merged.convex_hull.values
+
+            shapes = shapely.transform(shapes, lambda xy: np.round(xy, cls.precision))
+
+            cache.update({keys[key]: shapely.to_wkb(shape, hex=True) for key, shape in zip(merged.index, shapes)})
+
+        log.debug(f'Territory Hulls: {len(keys) - len(missing)} Cached | {len(missing)} Computed ({cls.hull_method})')
+
+        # Only the Current Territories are Kept - Written Aside and Swapped in so a Crash cannot Truncate the Cache
+        os.makedirs(os.path.dirname(cls.hullfile), exist_ok=True)
+        partial = cls.hullfile + '.partial'
+
+        with open(partial, 'w') as file:
+            json.dump({keys[key]: cache[keys[key]] for key in keys}, file)
+
+        os.replace(partial, cls.hullfile)
+
+        index = sorted(keys)
+
+        return gpd.GeoSeries(shapely.from_wkb([cache[keys[key]] for key in index]), index=index, crs=stores.crs)
+
+    @classmethod
+    def simplified(cls, territories: gpd.GeoDataFrame, zoom: int) -> gpd.GeoDataFrame:
+        """ Territory hulls simplified to `simplify_pixels` at a zoom level """
+
+        tolerance = cls.simplify_pixels * 360 / (256 * 2 ** zoom)
+
+        simplified = territories.copy()
+        simplified['geometry'] = territories.simplify(tolerance, preserve_topology=True)
+
+        return simplified
+
+    @staticmethod
+    def tile(lat: np.ndarray, lon: np.ndarray, zoom: int) -> tuple:
+        """ Web Mercator (slippy map) tile column and row of every point at a zoom level """
+
+        n = 2 ** zoom
+        lat = np.radians(np.clip(lat, -85.05112878, 85.05112878))
+
+        x = np.floor((lon + 180) / 360 * n).astype(int).clip(0, n - 1)
+        y = np.floor((1 - np.arcsinh(np.tan(lat)) / np.pi) / 2 * n).astype(int).clip(0, n - 1)
+
+        return (x, y)
+
+    @classmethod
+    @log.span('export')
+    def export(cls, df: pd.DataFrame = None) -> dict:
+        """
+            Writes clusters for static serving under `exportdir`
+
+            Layers:
+                stores.geojson / stores.fgb         Store points with their territory
+                territories.geojson / .fgb          Territory hulls, sizes and centres
+                territories/{z}.geojson             Territory hulls simplified per zoom in `tile_zooms`
+                tiles/{z}/{x}/{y}.geojson           Store points pre-tiled per zoom in `tile_zooms`
+
+            Args:
+                df: Clustered stores - defaults to the saved clusters artifact
+
+            Returns:
+                An index of the written layers and tiles (also the stage artifact)
+        """
+
+        log.state('Exporting Cluster Layers...')
+        if df is None:
+            df = Artifacts.read(Artifacts.path('clusters'))
+
+        stores, territories = cls.layers(df)
+
+        os.makedirs(cls.exportdir, exist_ok=True)
+
+        drivers = {'geojson': ('GeoJSON', 'geojson'), 'flatgeobuf': ('FlatGeobuf', 'fgb')}
+        layers = []
+
+        for kind in cls.export_formats:
+            driver, extension = drivers[kind]
+
+            for name, layer in (('stores', stores), ('territories', territories)):
+                filename = f'{name}.{extension}'
+                layer.to_file(os.path.join(cls.exportdir, filename), driver=driver)
+
+                layers.append(filename)
+
+        # Tiles are Rewritten from Scratch so Tiles Emptied since the Last Export do not Linger
+        tiledir = os.path.join(cls.exportdir, 'tiles')
+        shutil.rmtree(tiledir, ignore_errors=True)
+
+        hulldir = os.path.join(cls.exportdir, 'territories')
+        shutil.rmtree(hulldir, ignore_errors=True)
+        os.makedirs(hulldir)
+
+        for zoom in cls.tile_zooms:
+            cls.simplified(territories, zoom).to_file(os.path.join(hulldir, f'{zoom}.geojson'), driver='GeoJSON')
+
+        lat = stores['Latitude'].to_numpy()
+        lon = stores['Longitude'].to_numpy()
+
+        # Every Store is Serialized Once and its Feature Text Reused by the Tile at each Zoom
+        features = np.asarray([
+            json.dumps({
+                'type': 'Feature',
+                'properties': {'Account_Number': number, 'Account_Name': name, 'Territory': territory},
+                'geometry': {'type': 'Point', 'coordinates': [x, y]}
+            })
+            for number, name, territory, y, x in zip(
+                stores['Account_Number'].astype(str), stores['Account_Name'].astype(str),
+                stores['Territory'].tolist(), lat.tolist(), lon.tolist()
+            )
+        ], dtype=object)
+
+        tiles = {}
+
+        for zoom in cls.tile_zooms:
+            x, y = cls.tile(lat, lon, zoom)
+            tiles[zoom] = []
+
+            for (column, row), members in pd.Series(np.arange(len(features))).groupby([x, y]):
+                directory = os.path.join(tiledir, str(zoom), str(column))
+                os.makedirs(directory, exist_ok=True)
+
+                with open(os.path.join(directory, f'{row}.geojson'), 'w') as file:
+                    file.write('{"type": "FeatureCollection", "features": [' + ', '.join(features[members.to_numpy()]) + ']}')
+
+                tiles[zoom].append([int(column), int(row)])
+
+            log.debug(f'Zoom {zoom}: {len(tiles[zoom])} Tiles')
+
+        index = {
+            'layers': layers,
+            'bounds': stores.total_bounds.round(cls.precision).tolist(),
+            'tiles': {str(zoom): cells for zoom, cells in tiles.items()},
+            'template': 'tiles/{z}/{x}/{y}.geojson',
+            'territories': 'territories/{z}.geojson'
+        }
+
+        log.debug(f'Exported {len(stores)} Stores in {len(territories)} Territories to {cls.exportdir}')
+
+        return index
@@ -0,0 +1,489 @@
+import os
+import glob
+import hashlib
+
+import numpy as np
+
+from .spatial import SpatialIndex
+from .distance import Haversine
+from .parallel import WorkerPool
+from ..logger import CustomLogger as log
+
+
+class CondensedMatrix():
+    """
+        Complete distance matrix stored as a flat upper-triangle array
+
+        Entry (i, j) for i < j lives at `offset(i) + (j - i - 1)`, so any pair
+        of store indices can be resolved in constant time
+    """
+
+    dtype = np.float32
+    complete = True
+
+    def __init__(self, size: int, data: np.ndarray):
+        self.size = size
+        self.data = data
+
+    def __len__(self):
+        return self.size
+
+    @classmethod
+    def build(cls, points, *, progress=None, workers: int = None):
+        """
+            Calculates every pair-wise distance between a collection of points
+
+            Args:
+                points:     Collection of Latitude/Longitude points
+                progress:   Optional callback receiving the number of rows processed
+                workers:    Optional worker process count (see `WorkerPool`)
+
+            Returns:
+                A CondensedMatrix covering every point combination
+        """
+
+        coords = Haversine.coordinates(points)
+        size = len(coords)
+
+        data = np.empty(size * (size - 1) // 2, dtype=cls.dtype)
+
+        tasks = WorkerPool.chunks(size, Haversine.block_size)
+        shared = {"coords": coords, "data": data}
+
+        for start, stop in WorkerPool.map(cls._fill, tasks, shared=shared, outputs=("data",), workers=workers):
+            if progress is not None:
+                progress(stop - start)
+
+        return cls(size, data)
+
+    @staticmethod
+    def _fill(shared: dict, task: tuple) -> tuple:
+        start, stop = task
+
+        coords = shared["coords"]
+        data = shared["data"]
+
+        size = len(coords)
+
+        # Only the Upper Triangle (columns >= start) is required
+        block = Haversine.many_to_many(coords[start:stop], coords[start:])
+
+        for offset, row in enumerate(block):
+            i = start + offset
+            k = CondensedMatrix._offset(size, i)
+
+            data[k:k + size - i - 1] = row[offset + 1:]
+
+        return task
+
+    @staticmethod
+    def _offset(size: int, i):
+        return i * size - i * (i + 1) // 2
+
+    def distance(self, i: int, j: int) -> float:
+        if i == j:
+            return 0.0
+
+        i, j = min(i, j), max(i, j)
+
+        return float(self.data[self._offset(self.size, i) + (j - i - 1)])
+
+    def row(self, i: int) -> np.ndarray:
+        """ Returns the distances from store `i` to every store (0 for itself) """
+
+        row = np.empty(self.size, dtype=self.dtype)
+
+        j = np.arange(i)
+        row[:i] = self.data[self._offset(self.size, j) + (i - j - 1)]
+        row[i] = 0
+
+        k = self._offset(self.size, i)
+        row[i + 1:] = self.data[k:k + self.size - i - 1]
+
+        return row
+
+    def block(self, rows: np.ndarray, cols: np.ndarray) -> np.ndarray:
+        """ Returns the dense (rows x cols) distance block for two sets of store indices """
+
+        i = np.asarray(rows)[:, None]
+        j = np.asarray(cols)[None, :]
+
+        lo = np.minimum(i, j)
+        hi = np.maximum(i, j)
+
+        diagonal = (i == j)
+
+        block = np.zeros(diagonal.shape, dtype=self.dtype)
+        block[~diagonal] = self.data[(self._offset(self.size, lo) + (hi - lo - 1))[~diagonal]]
+
+        return block
+
+    def neighbors(self, i: int, radius: float) -> tuple:
+        row = self.row(i)
+
+        within = row < radius
+        within[i] = False
+
+        indices = np.flatnonzero(within)
+
+        return (indices, row[indices])
+
+    @staticmethod
+    def _stats(shared: dict, task: tuple) -> tuple:
+        size, radius, start, stop = task
+        matrix = CondensedMatrix(size, shared["data"])
+
+        counts = np.zeros(stop - start, dtype=np.int64)
+        means = np.full(stop - start, np.nan)
+
+        for offset, i in enumerate(range(start, stop)):
+            _, distances = matrix.neighbors(i, radius)
+
+            counts[offset] = len(distances)
+
+            if len(distances):
+                means[offset] = distances.sum(dtype=np.float64) / len(distances)
+
+        return (start, stop, counts, means)
+
+    def neighbor_stats(self, radius: float, *, progress=None, workers: int = None) -> tuple:
+        counts = np.zeros(self.size, dtype=np.int64)
+        means = np.full(self.size, np.nan)
+
+        tasks = [(self.size, radius, start, stop) for start, stop in WorkerPool.chunks(self.size, Haversine.block_size)]
+
+        for start, stop, population, average in WorkerPool.map(self._stats, tasks, shared={"data": self.data}, workers=workers):
+            counts[start:stop] = population
+            means[start:stop] = average
+
+            if progress is not None:
+                progress(stop - start)
+
+        return (counts, means)
+
+
+class RadiusGraph():
+    """
+        Sparse CSR distance matrix holding only the pairs within a fixed radius
+
+        Row `i` occupies `indices[indptr[i]:indptr[i + 1]]` (sorted store indices)
+        with the matching distances in `data`
+    """
+
+    dtype = np.float32
+    complete = False
+
+    def __init__(self, size: int, radius: float, indptr: np.ndarray, indices: np.ndarray, data: np.ndarray):
+        self.size = size
+        self.radius = radius
+
+        self.indptr = indptr
+        self.indices = indices
+        self.data = data
+
+    def __len__(self):
+        return self.size
+
+    @classmethod
+    def build(cls, points, *, radius: float, progress=None, workers: int = None):
+        """
+            Calculates the distances between every pair of points within range
+
+            Args:
+                points:     Collection of Latitude/Longitude points
+                radius:     Maximum stored distance in kilometers
+                progress:   Optional callback receiving the number of rows processed
+                workers:    Optional worker process count (see `WorkerPool`)
+
+            Returns:
+                A RadiusGraph of neighboring point pairs
+        """
+
+        index = SpatialIndex(points, cell_km=radius)
+        size = len(index)
+
+        rows, cols, distances = [np.empty(0, dtype=np.int64)], [np.empty(0, dtype=np.int64)], [np.empty(0)]
+
+        for r, c, d in index.pairs(radius, progress=progress, workers=workers):
+            rows.append(r)
+            cols.append(c)
+            distances.append(d)
+
+        rows = np.concatenate(rows)
+        cols = np.concatenate(cols)
+        distances = np.concatenate(distances)
+
+        order = np.lexsort((cols, rows))
+
+        indptr = np.zeros(size + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum(np.bincount(rows, minlength=size))
+
+        return cls(size, radius, indptr, cols[order].astype(np.int32), distances[order].astype(cls.dtype))
+
+    def distance(self, i: int, j: int):
+        if i == j:
+            return 0.0
+
+        start, stop = self.indptr[i], self.indptr[i + 1]
+        k = start + np.searchsorted(self.indices[start:stop], j)
+
+        if k < stop and self.indices[k] == j:
+            return float(self.data[k])
+
+        # Pair is beyond the stored radius
+        return None
+
+    def neighbors(self, i: int, radius: float = None) -> tuple:
+        start, stop = self.indptr[i], self.indptr[i + 1]
+
+        indices = self.indices[start:stop]
+        distances = self.data[start:stop]
+
+        if radius is not None and radius < self.radius:
+            within = distances < radius
+
+            indices = indices[within]
+            distances = distances[within]
+
+        return (indices, distances)
+
+    def neighbor_stats(self, radius: float, *, progress=None, workers: int = None) -> tuple:
+        # Already a Single Vectorized Pass - `workers` is accepted for a Uniform Interface
+        if radius > self.radius:
+            log.issue(f'Neighbor Radius {radius} km exceeds Stored Radius {self.radius} km - Counts will be Incomplete')
+
+        rows = np.repeat(np.arange(self.size), np.diff(self.indptr))
+        within = self.data < radius
+
+        counts = np.bincount(rows[within], minlength=self.size)
+        totals = np.bincount(rows[within], weights=self.data[within], minlength=self.size)
+
+        means = np.divide(totals, counts, out=np.full(self.size, np.nan), where=counts > 0)
+
+        if progress is not None:
+            progress(self.size)
+
+        return (counts, means)
+
+
+class MappedMatrix():
+    """
+        Complete square distance matrix backed by a memory-mapped file
+
+        The file is named after a hash of the coordinates so repeated runs over
+        the same stores reuse it; rows are only read from disk when requested.
+        Matrices for earlier store locations are deleted once a newer one exists
+    """
+
+    dtype = np.float32
+    complete = True
+
+    directory = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'static')
+
+    # Most Recent Matrix Files Kept on Disk (including the one in Use)
+    keep: int = 1
+
+    def __init__(self, path: str, size: int):
+        self.path = path
+        self.size = size
+
+        self.array = np.memmap(path, dtype=self.dtype, mode='r', shape=(size, size))
+
+    def __len__(self):
+        return self.size
+
+    @classmethod
+    def filename(cls, coords: np.ndarray) -> str:
+        digest = hashlib.sha1(np.ascontiguousarray(coords, dtype=np.float64).tobytes()).hexdigest()
+
+        return os.path.join(cls.directory, f'distances-{digest[:16]}.f32')
+
+    @classmethod
+    def prune(cls, current: str) -> None:
+        """ Deletes interrupted writes and all but the newest `keep` matrix files (never `current`) """
+
+        partials = glob.glob(os.path.join(cls.directory, 'distances-*.f32.partial'))
+        matrices = sorted(
+            (path for path in glob.glob(os.path.join(cls.directory, 'distances-*.f32')) if path != current),
+            key=os.path.getmtime, reverse=True
+        )
+
+        for path in partials + matrices[max(cls.keep - 1, 0):]:
+            try:
+                os.remove(path)
+                log.debug(f'Removed Stale Distance Matrix: {path}')
+
+            # Still Mapped by another Process (Windows) - Retried on the next Build
+            except OSError:
+                pass
+
+        return
+
+    @classmethod
+    def build(cls, points, *, progress=None, workers: int = None):
+        """
+            Fills (or reuses) an on-disk distance matrix in row blocks
+
+            Args:
+                points:     Collection of Latitude/Longitude points
+                progress:   Optional callback receiving the number of rows processed
+                workers:    Optional worker process count (see `WorkerPool`)
+
+            Returns:
+                A MappedMatrix covering every point combination
+        """
+
+        coords = Haversine.coordinates(points)
+        size = len(coords)
+
+        path = cls.filename(coords)
+
+        if os.path.exists(path) and os.path.getsize(path) == size * size * np.dtype(cls.dtype).itemsize:
+            log.debug(f'Reusing Mapped Distance Matrix: {path}')
+
+            if progress is not None:
+                progress(size)
+
+            cls.prune(path)
+
+            return cls(path, size)
+
+        log.debug(f'Writing Mapped Distance Matrix: {path}')
+        os.makedirs(cls.directory, exist_ok=True)
+
+        # Write to a Partial File so Interrupted Runs are never Reused
+        partial = path + '.partial'
+
+        array = np.memmap(partial, dtype=cls.dtype, mode='w+', shape=(size, size))
+        del array
+
+        tasks = [(partial, start, stop) for start, stop in WorkerPool.chunks(size, Haversine.block_size)]
+
+        for start, stop in WorkerPool.map(cls._fill, tasks, shared={"coords": coords}, workers=workers):
+            if progress is not None:
+                progress(stop - start)
+
+        os.replace(partial, path)
+        cls.prune(path)
+
+        return cls(path, size)
+
+    @staticmethod
+    def _fill(shared: dict, task: tuple) -> tuple:
+        path, start, stop = task
+
+        coords = shared["coords"]
+        size = len(coords)
+
+        array = np.memmap(path, dtype=MappedMatrix.dtype, mode='r+', shape=(size, size))
+        array[start:stop] = Haversine.many_to_many(coords[start:stop], coords)
+
+        array.flush()
+        del array
+
+        return (start, stop)
+
+    def distance(self, i: int, j: int) -> float:
+        return float(self.array[i, j])
+
+    def row(self, i: int) -> np.ndarray:
+        return np.asarray(self.array[i])
+
+    def block(self, rows: np.ndarray, cols: np.ndarray) -> np.ndarray:
+        """ Returns the dense (rows x cols) distance block for two sets of store indices """
+
+        return np.asarray(self.array[np.asarray(rows)][:, np.asarray(cols)])
+
+    def neighbors(self, i: int, radius: float) -> tuple:
+        row = self.row(i)
+
+        within = row < radius
+        within[i] = False
+
+        indices = np.flatnonzero(within)
+
+        return (indices, row[indices])
+
+    @staticmethod
+    def _stats(shared: dict, task: tuple) -> tuple:
+        path, size, radius, start, stop = task
+
+        array = np.memmap(path, dtype=MappedMatrix.dtype, mode='r', shape=(size, size))
+        block = np.asarray(array[start:stop])
+
+        within = block < radius
+        within[np.arange(stop - start), np.arange(start, stop)] = False
+
+        population = within.sum(axis=1)
+        total = np.where(within, block, 0).sum(axis=1, dtype=np.float64)
+
+        means = np.divide(total, population, out=np.full(stop - start, np.nan), where=population > 0)
+
+        return (start, stop, population, means)
+
+    def neighbor_stats(self, radius: float, *, progress=None, workers: int = None) -> tuple:
+        counts = np.zeros(self.size, dtype=np.int64)
+        means = np.full(self.size, np.nan)
+
+        tasks = [
+            (self.path, self.size, radius, start, stop)
+            for start, stop in WorkerPool.chunks(self.size, Haversine.block_size)
+        ]
+
+        for start, stop, population, average in WorkerPool.map(self._stats, tasks, workers=workers):
+            counts[start:stop] = population
+            means[start:stop] = average
+
+            if progress is not None:
+                progress(stop - start)
+
+        return (counts, means)
+
+
+class DistanceMatrix():
+    """
+        Selects a compact distance store based on the number of points
+
+        Small collections are stored as a complete CondensedMatrix; larger ones
+        only keep the pairs within the clustering radius in a RadiusGraph. When
+        `mapped` is set the complete matrix is kept on disk in a MappedMatrix
+    """
+
+    dense_limit: int = 10000
+    mapped: bool = False
+
+    @classmethod
+    def build(cls, points, *, radius: float, dense_limit: int = None, mapped: bool = None, progress=None, workers: int = None):
+        """
+            Builds an index-addressed distance store for a collection of points
+
+            Args:
+                points:         Collection of Latitude/Longitude points
+                radius:         Clustering Radius in kilometers (used by the sparse store)
+                dense_limit:    Largest collection stored as a complete in-memory matrix
+                mapped:         Back the complete matrix with a memory-mapped file instead
+                progress:       Optional callback receiving the number of rows processed
+                workers:        Optional worker process count (see `WorkerPool`)
+
+            Returns:
+                A CondensedMatrix, RadiusGraph or MappedMatrix
+        """
+
+        coords = Haversine.coordinates(points)
+
+        dense_limit = cls.dense_limit if dense_limit is None else dense_limit
+        mapped = cls.mapped if mapped is None else mapped
+
+        if mapped:
+            log.debug(f'Storing {len(coords)} Points in a Memory-Mapped Distance Matrix')
+
+            return MappedMatrix.build(coords, progress=progress, workers=workers)
+
+        if len(coords) <= dense_limit:
+            log.debug(f'Storing {len(coords)} Points in a Condensed Distance Matrix')
+
+            return CondensedMatrix.build(coords, progress=progress, workers=workers)
+
+        log.debug(f'Storing {len(coords)} Points in a Sparse Radius Graph ({radius} km)')
+
+        return RadiusGraph.build(coords, radius=radius, progress=progress, workers=workers)
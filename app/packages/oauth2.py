@@ -10,6 +10,8 @@ from selenium.webdriver.support.ui import WebDriverWait
 from webdriver_manager.chrome import ChromeDriverManager
 from selenium.webdriver.support import expected_conditions as EC
 
+from .tokens import TokenStore
+from .session import HTTPSession
 from ..secrets import SecretManager
 from ..logger import CustomLogger as log
 
@@ -17,6 +19,14 @@ from ..logger import CustomLogger as log
 class OAuth2():
     redirect = 'http://localhost:8000'
 
+    @staticmethod
+    def getScope() -> str:
+        # `offline_access` is Required for the Token Endpoint to Issue Refresh Tokens
+        if SecretManager.DynamicsEndpoint is None:
+            return None
+
+        return SecretManager.DynamicsEndpoint + '.default offline_access'
+
     @staticmethod
     def getBrowserEngine() -> webdriver.Chrome:
         options = webdriver.ChromeOptions()
@@ -40,7 +50,7 @@ class OAuth2():
             'response_type': 'code',
             'redirect_uri': cls.redirect,
             'response_mode': 'query',
-            'scope': SecretManager.DynamicsEndpoint + '.default',
+            'scope': cls.getScope(),
             'state': '12345'
         }
 
@@ -109,16 +119,22 @@ class OAuth2():
         return authcode
     
     @classmethod
-    def refreshToken(cls, *, authorization: str) -> str:
-        log.state('Converting Authorization Code...')
+    def requestToken(cls, grant: dict) -> dict:
+        """
+            Posts a grant to the token endpoint
+
+            Args:
+                grant: Grant specific form fields (grant_type and its code or refresh token)
+
+            Returns:
+                The decoded token response, or None when the endpoint rejects the grant
+        """
 
         data = {
             'client_id': SecretManager.DynamicsID,
             'client_secret': SecretManager.DynamicsKey,
-            'scope': SecretManager.DynamicsEndpoint + '.default',
-            'grant_type': 'authorization_code',
-            'redirect_uri': cls.redirect,
-            'code': authorization
+            'scope': cls.getScope(),
+            **grant
         }
 
         headers = {
@@ -132,29 +148,89 @@ class OAuth2():
             
             return sys.exit()
     
-        response = requests.post(url, headers=headers, data=data)
+        try:
+            response = HTTPSession.post(url, headers=headers, data=data)
+
+        except requests.RequestException as error:
+            log.issue(f'Token Request Failed: {error}')
+
+            return None
 
         try:
-            token = response.json()['access_token']
-            log.debug('Retrieved Access Token...')
+            payload = response.json()
+
+        except ValueError:
+            payload = {}
+
+        if 'access_token' not in payload:
+            log.issue(f'Token Request Rejected ({response.status_code}): {payload.get("error", "Unknown Error")}')
+
+            return None
+
+        return payload
+
+    @classmethod
+    def refreshToken(cls, *, authorization: str) -> str:
+        log.state('Converting Authorization Code...')
 
-        except KeyError:
+        payload = cls.requestToken({
+            'grant_type': 'authorization_code',
+            'redirect_uri': cls.redirect,
+            'code': authorization
+        })
+
+        if payload is None:
             log.fatal('Invalid Access Code Recieved - Terminating...')
             
             return sys.exit(0)
 
-        return token
+        log.debug('Retrieved Access Token...')
+        token = TokenStore.save(payload)
+
+        return token['access_token']
+
+    @classmethod
+    def renewToken(cls, *, refresh: str) -> str:
+        """ Exchanges a refresh token for a new access token, returning None if it was rejected """
+
+        log.state('Refreshing Access Token...')
+
+        payload = cls.requestToken({
+            'grant_type': 'refresh_token',
+            'refresh_token': refresh
+        })
+
+        if payload is None:
+            return None
+
+        log.debug('Retrieved Refreshed Access Token...')
+        token = TokenStore.save(payload)
+
+        return token['access_token']
     
     @classmethod
     def authorize(cls):
-        code = cls.spoofAuthorization()
-        token = cls.refreshToken(authorization=code)
+        """
+            Retrieves an access token, preferring (in order) the cached token, the
+            refresh token grant and finally the simulated browser sign-in
+        """
 
-        return token
+        cached = TokenStore.load()
 
+        if TokenStore.valid(cached):
+            log.debug('Using Cached Access Token...')
 
-        
+            return cached['access_token']
 
+        if cached.get('refresh_token'):
+            token = cls.renewToken(refresh=cached['refresh_token'])
 
+            if token is not None:
+                return token
 
+            log.issue('Unable to Refresh Access Token - Falling Back to Web Flow...')
 
+        code = cls.spoofAuthorization()
+        token = cls.refreshToken(authorization=code)
+
+        return token
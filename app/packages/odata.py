@@ -0,0 +1,84 @@
+class ODataQuery():
+    """
+        Composable OData request builder
+
+        Each method returns the query so clauses can be chained:
+
+            ODataQuery('accounts').select('name').where('statecode eq 0').build(base)
+    """
+
+    def __init__(self, entity: str):
+        self.entity = entity
+
+        self.columns = []
+        self.clauses = []
+        self.ordering = []
+
+        self.limit = None
+
+    def select(self, *columns: str):
+        """ Projects the response onto the given columns ($select) """
+
+        self.columns.extend(column for column in columns if column not in self.columns)
+
+        return self
+
+    def where(self, *clauses: str):
+        """ Adds filter clauses, combined with `and` ($filter) """
+
+        self.clauses.extend(clauses)
+
+        return self
+
+    def exclude(self, column: str, values: list):
+        """ Filters out rows where `column` equals any of `values` """
+
+        return self.where(*[f'{column} ne {value}' for value in values])
+
+    def excludeContaining(self, column: str, text: str):
+        """ Filters out rows where `column` contains `text` """
+
+        return self.where(f"not contains({column},'{text}')")
+
+    def orderby(self, *columns: str):
+        self.ordering.extend(columns)
+
+        return self
+
+    def top(self, limit: int):
+        self.limit = limit
+
+        return self
+
+    @property
+    def params(self) -> dict:
+        params = {}
+
+        if self.columns:
+            params['$select'] = ','.join(self.columns)
+
+        if self.clauses:
+            params['$filter'] = ' and '.join(self.clauses)
+
+        if self.ordering:
+            params['$orderby'] = ','.join(self.ordering)
+
+        if self.limit is not None:
+            params['$top'] = str(self.limit)
+
+        return params
+
+    def build(self, base: str) -> str:
+        """
+            Renders the full request URL
+
+            Args:
+                base: Service root including the API version (e.g. https://org.crm.dynamics.com/api/data/v9.2/)
+
+            Returns:
+                The entity URL with its query options
+        """
+
+        query = '&'.join(f'{key}={value}' for key, value in self.params.items())
+
+        return base + self.entity + (f'?{query}' if query else '')
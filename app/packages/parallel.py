@@ -0,0 +1,144 @@
+import os
+
+import numpy as np
+
+from itertools import repeat
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor
+
+
+class SharedArray():
+    """
+        NumPy array stored in a `multiprocessing.shared_memory` segment
+
+        Worker processes attach to the segment by name, so large inputs and
+        outputs are never pickled between processes
+    """
+
+    def __init__(self, memory: shared_memory.SharedMemory, shape: tuple, dtype: str, *, owner: bool):
+        self.memory = memory
+        self.owner = owner
+
+        self.array = np.ndarray(shape, dtype=dtype, buffer=memory.buf)
+
+    @classmethod
+    def create(cls, array: np.ndarray, *, copy: bool = True):
+        memory = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        shared = cls(memory, array.shape, array.dtype.str, owner=True)
+
+        if copy:
+            shared.array[...] = array
+
+        return shared
+
+    @classmethod
+    def attach(cls, spec: tuple):
+        name, shape, dtype = spec
+        memory = shared_memory.SharedMemory(name=name)
+
+        return cls(memory, shape, dtype, owner=False)
+
+    @property
+    def spec(self) -> tuple:
+        return (self.memory.name, self.array.shape, self.array.dtype.str)
+
+    def close(self):
+        del self.array
+        self.memory.close()
+
+        if self.owner:
+            self.memory.unlink()
+
+
+def _execute(func, specs: dict, task):
+    segments = {name: SharedArray.attach(spec) for name, spec in specs.items()}
+
+    try:
+        return func({name: segment.array for name, segment in segments.items()}, task)
+
+    finally:
+        for segment in segments.values():
+            segment.close()
+
+
+class WorkerPool():
+    """
+        Runs block-wise stages either in-process or across a process pool
+
+        Every task receives a dict of shared arrays plus its own task arguments,
+        so the serial and parallel paths execute identical code per block
+    """
+
+    # Number of Worker Processes (1 = Serial)
+    workers: int = 1
+
+    # Tasks Submitted per Worker (smaller tasks balance uneven blocks)
+    tasks_per_worker: int = 4
+
+    @classmethod
+    def resolve(cls, workers: int = None) -> int:
+        workers = cls.workers if workers is None else workers
+
+        if workers <= 0:
+            workers = os.cpu_count() or 1
+
+        return workers
+
+    @staticmethod
+    def chunks(total: int, size: int) -> list:
+        """ Splits `total` rows into (start, stop) blocks of at most `size` rows """
+
+        return [(start, min(start + size, total)) for start in range(0, total, size)]
+
+    @classmethod
+    def partition(cls, items: list, workers: int = None) -> list:
+        """ Splits a list into roughly `tasks_per_worker` contiguous chunks per worker """
+
+        workers = cls.resolve(workers)
+        count = min(len(items), workers * cls.tasks_per_worker) or 1
+
+        return [chunk.tolist() for chunk in np.array_split(np.asarray(items), count) if len(chunk)]
+
+    @classmethod
+    def map(cls, func, tasks: list, *, shared: dict = None, outputs: tuple = (), workers: int = None):
+        """
+            Applies `func(shared, task)` to every task, yielding results in task order
+
+            Args:
+                func:       Top-level function (or static method) executed per task
+                tasks:      Picklable task arguments
+                shared:     Named arrays made available to every task
+                outputs:    Names of shared arrays written by the tasks (copied back afterwards)
+                workers:    Worker process count (defaults to `WorkerPool.workers`, <= 0 uses every core)
+
+            Yields:
+                The result of each task
+        """
+
+        shared = shared or {}
+        workers = cls.resolve(workers)
+
+        if workers <= 1 or len(tasks) <= 1:
+            for task in tasks:
+                yield func(shared, task)
+
+            return
+
+        segments = {
+            name: SharedArray.create(array, copy=name not in outputs)
+            for name, array in shared.items()
+        }
+
+        try:
+            specs = {name: segment.spec for name, segment in segments.items()}
+
+            with ProcessPoolExecutor(max_workers=min(workers, len(tasks))) as executor:
+                for result in executor.map(_execute, repeat(func), repeat(specs), tasks):
+                    yield result
+
+            for name in outputs:
+                shared[name][...] = segments[name].array
+
+        finally:
+            for segment in segments.values():
+                segment.close()
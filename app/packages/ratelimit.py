@@ -0,0 +1,41 @@
+import time
+import threading
+
+
+class TokenBucket():
+    """
+        Thread-safe token bucket rate limiter
+
+        Tokens refill continuously at `rate` per second up to `capacity`; each
+        request consumes one token and blocks until a token is available
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or max(rate, 1)
+
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens: float = 1) -> None:
+        # Non-Positive Rates disable Limiting
+        if self.rate <= 0:
+            return
+
+        while True:
+            with self.lock:
+                now = time.monotonic()
+
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+
+                    return
+
+                wait = (tokens - self.tokens) / self.rate
+
+            time.sleep(wait)
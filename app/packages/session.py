@@ -0,0 +1,97 @@
+import threading
+
+import requests
+
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from ..logger import CustomLogger as log
+
+
+class HTTPSession():
+    """
+        Shared, connection-pooled HTTP session
+
+        Every request goes through one `requests.Session` per process, so
+        connections (and their TLS handshakes) are kept alive and reused. Requests
+        receive a default timeout and are retried with exponential backoff on
+        throttling (429) and transient server errors, honouring `Retry-After`
+    """
+
+    # Connections Kept Alive per Host
+    pool_size: int = 10
+
+    # (Connect, Read) Timeouts in Seconds
+    timeout: tuple = (10, 120)
+
+    retries: int = 5
+    backoff: float = 0.5
+    retry_statuses: tuple = (429, 500, 502, 503, 504)
+
+    _session: requests.Session = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def build(cls) -> requests.Session:
+        retry = Retry(
+            total=cls.retries,
+            backoff_factor=cls.backoff,
+            status_forcelist=cls.retry_statuses,
+            allowed_methods=frozenset(['GET', 'POST']),
+            respect_retry_after_header=True,
+            raise_on_status=False
+        )
+
+        adapter = HTTPAdapter(pool_connections=cls.pool_size, pool_maxsize=cls.pool_size, max_retries=retry)
+
+        session = requests.Session()
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+
+        session.headers['Accept-Encoding'] = 'gzip, deflate'
+
+        return session
+
+    @classmethod
+    def session(cls) -> requests.Session:
+        with cls._lock:
+            if cls._session is None:
+                log.trace(f'Opening HTTP Session (Pool Size: {cls.pool_size})...')
+                cls._session = cls.build()
+
+        return cls._session
+
+    @classmethod
+    def request(cls, method: str, url: str, **kwargs) -> requests.Response:
+        """
+            Sends a request through the shared session
+
+            Args:
+                method: HTTP method
+                url:    Request URL
+                kwargs: Forwarded to `requests.Session.request` (`timeout` defaults to `HTTPSession.timeout`)
+
+            Returns:
+                The final response once retries are exhausted or a non-retryable status is received
+        """
+
+        kwargs.setdefault('timeout', cls.timeout)
+
+        return cls.session().request(method, url, **kwargs)
+
+    @classmethod
+    def get(cls, url: str, **kwargs) -> requests.Response:
+        return cls.request('GET', url, **kwargs)
+
+    @classmethod
+    def post(cls, url: str, **kwargs) -> requests.Response:
+        return cls.request('POST', url, **kwargs)
+
+    @classmethod
+    def close(cls) -> None:
+        with cls._lock:
+            if cls._session is not None:
+                cls._session.close()
+                cls._session = None
+
+        return
@@ -0,0 +1,224 @@
+import math
+
+import numpy as np
+
+from .distance import Haversine
+from .parallel import WorkerPool
+
+
+class SpatialIndex():
+    """
+        Latitude/Longitude grid index for radius-neighbor queries
+
+        Points are bucketed into square cells (in degrees) sized from `cell_km`;
+        queries only inspect the cells that can intersect the search radius and
+        refine the candidates with exact haversine distances. Points without
+        finite coordinates are left out of the grid and have no neighbors
+    """
+
+    # Kilometers per Degree of Latitude (approximate)
+    km_per_degree: float = (math.pi / 180) * Haversine.radius
+
+    def __init__(self, points, *, cell_km: float):
+        self.coords = Haversine.coordinates(points)
+        self.cell_km = cell_km
+        self.cell = max(cell_km / self.km_per_degree, 1e-6)
+
+        self.nrows = int(math.ceil(180 / self.cell)) + 1
+        self.ncols = int(math.ceil(360 / self.cell))
+
+        # Longitude Cells evenly divide the globe so column indices wrap at the antimeridian
+        self.cell_lon = 360 / self.ncols
+
+        placed = np.flatnonzero(np.isfinite(self.coords).all(axis=1))
+        self.unplaced = len(self.coords) - len(placed)
+
+        rows, cols = self._cells(self.coords[placed, 0], self.coords[placed, 1])
+        keys = rows * self.ncols + cols
+
+        # Group Placed Point Indices by Cell
+        order = np.argsort(keys, kind="stable")
+        self.order = placed[order]
+        unique, starts, counts = np.unique(keys[order], return_index=True, return_counts=True)
+
+        self.buckets = {
+            key: (start, start + count)
+            for key, start, count in zip(unique.tolist(), starts.tolist(), counts.tolist())
+        }
+
+    def __len__(self):
+        return len(self.coords)
+
+    def _cells(self, lat, lon) -> tuple:
+        rows = np.floor((np.asarray(lat) + 90) / self.cell).astype(np.int64)
+        cols = np.floor((np.asarray(lon) + 180) / self.cell_lon).astype(np.int64) % self.ncols
+
+        return (np.clip(rows, 0, self.nrows - 1), cols)
+
+    def _span(self, south: float, north: float, west: float, east: float, radius: float) -> np.ndarray:
+        # Angular Radius of the Search Cap
+        theta = radius / Haversine.radius
+
+        dlat = math.degrees(theta)
+
+        # Widest Longitude Extent occurs at the Latitude closest to a Pole
+        latitude = math.radians(min(90.0, max(abs(south), abs(north))))
+
+        if math.sin(theta) >= math.cos(latitude):
+            dlon = 180.0
+        else:
+            dlon = math.degrees(math.asin(math.sin(theta) / math.cos(latitude)))
+
+        row_min = max(0, int(math.floor((south - dlat + 90) / self.cell)))
+        row_max = min(self.nrows - 1, int(math.floor((north + dlat + 90) / self.cell)))
+
+        col_min = int(math.floor((west - dlon + 180) / self.cell_lon))
+        col_max = int(math.floor((east + dlon + 180) / self.cell_lon))
+
+        if col_max - col_min + 1 >= self.ncols:
+            cols = range(self.ncols)
+        else:
+            cols = [col % self.ncols for col in range(col_min, col_max + 1)]
+
+        keys = [
+            row * self.ncols + col
+            for row in range(row_min, row_max + 1)
+            for col in cols
+            if row * self.ncols + col in self.buckets
+        ]
+
+        if not keys:
+            return np.empty(0, dtype=np.int64)
+
+        return np.concatenate([self.order[slice(*self.buckets[key])] for key in keys])
+
+    def query_radius(self, point: tuple, radius: float) -> tuple:
+        """
+            Locates all indexed points within range of a single point
+
+            Args:
+                point:  Latitude/Longitude tuple for the Search Centre
+                radius: Search Radius in kilometers
+
+            Returns:
+                (indices, distances) arrays for every point closer than `radius`
+        """
+
+        lat, lon = point
+
+        if not (math.isfinite(lat) and math.isfinite(lon)):
+            return (np.empty(0, dtype=np.int64), np.empty(0))
+
+        candidates = self._span(lat, lat, lon, lon, radius)
+        distances = Haversine.one_to_many(point, self.coords[candidates])
+
+        within = distances < radius
+
+        return (candidates[within], distances[within])
+
+    def _neighborhoods(self, radius: float, keys: list = None):
+        # Yields Row Blocks of (points, candidates, distances, within-range mask)
+        for key in (self.buckets if keys is None else keys):
+            start, stop = self.buckets[key]
+            members = self.order[start:stop]
+
+            row, col = divmod(key, self.ncols)
+
+            south = row * self.cell - 90
+            west = col * self.cell_lon - 180
+
+            candidates = self._span(south, south + self.cell, west, west + self.cell_lon, radius)
+
+            for _start, _stop, block in Haversine.blocks(self.coords[members], self.coords[candidates]):
+                rows = members[_start:_stop]
+                within = (block < radius) & (candidates[None, :] != rows[:, None])
+
+                yield (rows, candidates, block, within)
+
+    def _pairs(self, radius: float, keys: list = None):
+        for rows, candidates, block, within in self._neighborhoods(radius, keys):
+            r, c = np.nonzero(within)
+
+            yield (rows, (rows[r], candidates[c], block[r, c]))
+
+    def _stats(self, radius: float, keys: list = None):
+        for rows, candidates, block, within in self._neighborhoods(radius, keys):
+            population = within.sum(axis=1)
+            total = np.where(within, block, 0).sum(axis=1)
+
+            yield (rows, (population, total))
+
+    @staticmethod
+    def _task(shared: dict, task: tuple) -> list:
+        method, cell_km, radius, keys = task
+
+        # Each Worker rebuilds the (deterministic) Grid over the Shared Coordinates
+        index = SpatialIndex(shared["coords"], cell_km=cell_km)
+
+        return list(getattr(index, method)(radius, keys))
+
+    def _map(self, method: str, radius: float, workers: int = None):
+        if WorkerPool.resolve(workers) <= 1:
+            yield from getattr(self, method)(radius)
+
+            return
+
+        tasks = [
+            (method, self.cell_km, radius, keys)
+            for keys in WorkerPool.partition(list(self.buckets), workers)
+        ]
+
+        for results in WorkerPool.map(SpatialIndex._task, tasks, shared={"coords": self.coords}, workers=workers):
+            yield from results
+
+    def pairs(self, radius: float, *, progress=None, workers: int = None):
+        """
+            Lazily enumerates every ordered pair of indexed points within range
+
+            Args:
+                radius:     Search Radius in kilometers
+                progress:   Optional callback receiving the number of points processed
+                workers:    Optional worker process count (see `WorkerPool`)
+
+            Yields:
+                (rows, cols, distances) arrays describing one block of neighboring pairs
+        """
+
+        # Unplaced Points have no Pairs
+        if progress is not None and self.unplaced:
+            progress(self.unplaced)
+
+        for rows, pairs in self._map("_pairs", radius, workers):
+            yield pairs
+
+            if progress is not None:
+                progress(len(rows))
+
+    def neighbor_stats(self, radius: float, *, progress=None, workers: int = None) -> tuple:
+        """
+            Calculates neighbor counts and mean neighbor distances for every indexed point
+
+            Args:
+                radius:     Search Radius in kilometers
+                progress:   Optional callback receiving the number of points processed
+                workers:    Optional worker process count (see `WorkerPool`)
+
+            Returns:
+                (counts, means) arrays aligned with the indexed points (self excluded)
+        """
+
+        counts = np.zeros(len(self.coords), dtype=np.int64)
+        means = np.full(len(self.coords), np.nan)
+
+        # Unplaced Points keep 0 Neighbors and a NaN Mean
+        if progress is not None and self.unplaced:
+            progress(self.unplaced)
+
+        for rows, (population, total) in self._map("_stats", radius, workers):
+            counts[rows] = population
+            means[rows] = np.divide(total, population, out=np.full(len(rows), np.nan), where=population > 0)
+
+            if progress is not None:
+                progress(len(rows))
+
+        return (counts, means)
@@ -0,0 +1,142 @@
+import os
+import sys
+import json
+import time
+import hashlib
+
+from ..logger import CustomLogger as log
+
+
+class StageCache():
+    """
+        Content-hashed cache of pipeline stage artifacts
+
+        A stage's key hashes its parameters, the source of the modules that
+        implement it and the artifact digests of the stages it consumes. When the
+        key matches the last run and the artifact still exists, the stage is
+        skipped and its artifact loaded instead
+    """
+
+    path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'static', 'stages.json')
+
+    @staticmethod
+    def digest(path: str) -> str:
+        """ SHA-1 of a file's contents """
+
+        sha = hashlib.sha1()
+
+        with open(path, 'rb') as file:
+            for chunk in iter(lambda: file.read(1 << 20), b''):
+                sha.update(chunk)
+
+        return sha.hexdigest()
+
+    @classmethod
+    def manifest(cls) -> dict:
+        if not os.path.exists(cls.path):
+            return {}
+
+        try:
+            with open(cls.path) as file:
+                return json.load(file)
+
+        except (OSError, ValueError):
+            log.issue(f'Unable to Read Stage Manifest: {cls.path}')
+
+            return {}
+
+    @classmethod
+    def record(cls, stage: str, entry: dict) -> None:
+        manifest = cls.manifest()
+        manifest[stage] = entry
+
+        os.makedirs(os.path.dirname(cls.path), exist_ok=True)
+
+        with open(cls.path, 'w') as file:
+            json.dump(manifest, file, indent=4)
+
+        return
+
+    @classmethod
+    def key(cls, stage: str, *, inputs: tuple = (), params: dict = None, sources: tuple = ()) -> str:
+        """
+            Hashes everything a stage's output depends on
+
+            Args:
+                stage:      Stage name
+                inputs:     Names of upstream stages whose artifacts the stage consumes
+                params:     JSON-serializable stage parameters
+                sources:    Modules implementing the stage - editing them invalidates the stage
+
+            Returns:
+                A hex digest identifying the stage's inputs
+        """
+
+        manifest = cls.manifest()
+
+        material = {
+            'stage': stage,
+            'inputs': {name: manifest.get(name, {}).get('digest') for name in inputs},
+            'params': params or {},
+            'sources': {
+                module: cls.digest(sys.modules[module].__file__)
+                for module in sources
+            }
+        }
+
+        encoded = json.dumps(material, sort_keys=True, default=str).encode()
+
+        return hashlib.sha1(encoded).hexdigest()
+
+    @classmethod
+    def run(cls, stage: str, func, *, artifact: str, save, load, inputs: tuple = (),
+            params: dict = None, sources: tuple = (), force: bool = False, max_age: float = None):
+        """
+            Executes a stage, or loads its artifact when nothing it depends on has changed
+
+            Args:
+                stage:      Stage name (also the manifest entry)
+                func:       Zero-argument callable producing the stage's result
+                artifact:   Path the result is saved to / loaded from
+                save:       Callable (result, path) writing the artifact
+                load:       Callable (path) reading the artifact back
+                inputs:     Upstream stage names (see `key`)
+                params:     Stage parameters (see `key`)
+                sources:    Module names implementing the stage (see `key`)
+                force:      Re-run the stage regardless of the cache
+                max_age:    Optional seconds after which a cached artifact is stale (0 always re-runs)
+
+            Returns:
+                The stage's result
+        """
+
+        with log.span(f'stage.{stage}', stage=stage) as span:
+            key = cls.key(stage, inputs=inputs, params=params, sources=sources)
+            entry = cls.manifest().get(stage, {})
+
+            fresh = (
+                not force
+                and entry.get('key') == key
+                and os.path.exists(artifact)
+                and entry.get('digest') == cls.digest(artifact)
+                and (max_age is None or time.time() - entry.get('timestamp', 0) < max_age)
+            )
+
+            span.update(cached=fresh)
+
+            if fresh:
+                log.state(f'Stage [{stage}] Unchanged - Loading Cached Artifact...')
+                result = load(artifact)
+
+            else:
+                log.debug(f'Running Stage [{stage}]...')
+                result = func()
+
+                save(result, artifact)
+
+                cls.record(stage, {'key': key, 'digest': cls.digest(artifact), 'timestamp': time.time()})
+
+            if hasattr(result, 'shape'):
+                span.update(rows=len(result))
+
+        return result
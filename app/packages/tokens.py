@@ -0,0 +1,88 @@
+import os
+import json
+import time
+
+from ..logger import CustomLogger as log
+
+
+class TokenStore():
+    """
+        Persistent cache of OAuth 2.0 tokens
+
+        Holds the access token, its expiry and the latest refresh token so a new
+        process can reuse or refresh the session instead of repeating the browser
+        sign-in. Refresh tokens are rotated: every token response replaces the
+        stored refresh token when it includes a new one
+    """
+
+    path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'static', 'token.json')
+
+    # Seconds before Expiry at which an Access Token is Refreshed Proactively
+    margin: float = 300
+
+    @classmethod
+    def load(cls) -> dict:
+        """ Reads the stored tokens, returning an empty dictionary when none are saved """
+
+        if not os.path.exists(cls.path):
+            return {}
+
+        try:
+            with open(cls.path) as file:
+                return json.load(file)
+
+        except (OSError, ValueError):
+            log.issue(f'Unable to Read Token Cache: {cls.path}')
+
+            return {}
+
+    @classmethod
+    def save(cls, response: dict) -> dict:
+        """
+            Stores a token endpoint response
+
+            Args:
+                response: Decoded token response (access_token, expires_in and optionally refresh_token)
+
+            Returns:
+                The stored token record
+        """
+
+        previous = cls.load()
+
+        token = {
+            'access_token': response['access_token'],
+            'refresh_token': response.get('refresh_token') or previous.get('refresh_token'),
+            'expires_at': time.time() + float(response.get('expires_in', 0))
+        }
+
+        os.makedirs(os.path.dirname(cls.path), exist_ok=True)
+
+        # Written Owner-Only and Swapped into Place so a Crash never Leaves a Partial File
+        partial = cls.path + '.partial'
+        descriptor = os.open(partial, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+
+        with os.fdopen(descriptor, 'w') as file:
+            json.dump(token, file)
+
+        os.replace(partial, cls.path)
+
+        log.debug('Saved Access Token to Token Cache...')
+
+        return token
+
+    @classmethod
+    def valid(cls, token: dict) -> bool:
+        """ Whether an access token exists and does not expire within `margin` seconds """
+
+        if not token.get('access_token'):
+            return False
+
+        return token.get('expires_at', 0) - cls.margin > time.time()
+
+    @classmethod
+    def clear(cls) -> None:
+        if os.path.exists(cls.path):
+            os.remove(cls.path)
+
+        return
@@ -0,0 +1,91 @@
+"""
+    Benchmarks the farthest-pair search used by ClusterEngine.split
+
+    Usage:
+        python -m benchmarks.split
+
+    The original per-pair search (three scalar haversines per pair) is timed on a
+    sample of rows and extrapolated for the larger cluster sizes
+"""
+
+import math
+import time
+
+import numpy as np
+
+from app.packages.clusters import ClusterEngine
+
+
+sizes = [250, 1000, 5000]
+
+# Rows timed for the original search before extrapolating
+sample_rows = 50
+
+
+def haversine(a: tuple, b: tuple) -> float:
+    r = 6371.0
+
+    ay, ax = math.radians(a[0]), math.radians(a[1])
+    by, bx = math.radians(b[0]), math.radians(b[1])
+
+    z = (math.sin((by - ay) / 2) ** 2) + math.cos(ay) * math.cos(by) * (math.sin((bx - ax) / 2) ** 2)
+
+    return r * 2 * math.atan2(math.sqrt(z), math.sqrt(1 - z))
+
+
+def original(points: list, centre: tuple, rows: int) -> float:
+    # Seconds spent on the first `rows` rows of the original double loop
+    start = time.perf_counter()
+
+    for index, coord1 in enumerate(points[:rows]):
+        for _index, coord2 in enumerate(points):
+            if index == _index:
+                continue
+
+            sum((haversine(coord1, centre), haversine(coord2, centre), haversine(coord1, coord2)))
+
+    return time.perf_counter() - start
+
+
+def perimeter(pair: tuple, centre: tuple) -> float:
+    a, b = pair
+
+    return haversine(a, centre) + haversine(b, centre) + haversine(a, b)
+
+
+def generate(size: int, rng: np.random.Generator) -> tuple:
+    centre = (41.0, -87.5)
+
+    lat = rng.normal(centre[0], 1.2, size)
+    lon = rng.normal(centre[1], 1.6, size)
+
+    return (np.column_stack((lat, lon)), centre)
+
+
+def main():
+    rng = np.random.default_rng(0)
+
+    print(f'{"Points":>8} {"Original (s)":>14} {"Exact (s)":>11} {"Hull (s)":>10} {"Speedup":>9} {"Hull / Exact Perimeter":>24}')
+
+    for size in sizes:
+        coords, centre = generate(size, rng)
+        points = [tuple(point) for point in coords.tolist()]
+
+        rows = min(size, sample_rows)
+        baseline = original(points, centre, rows) * (size / rows)
+
+        start = time.perf_counter()
+        exact = ClusterEngine.seedPair(coords, centre, method='exact')
+        exact_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        hull = ClusterEngine.seedPair(coords, centre, method='hull')
+        hull_time = time.perf_counter() - start
+
+        ratio = perimeter(hull, centre) / perimeter(exact, centre)
+
+        print(f'{size:>8} {baseline:>14.3f} {exact_time:>11.3f} {hull_time:>10.4f} {baseline / hull_time:>8.0f}x {ratio:>24.6f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,24 @@
+import argparse
+
 from app import ControlFlow
+from app.logger import CustomLogger
 
 
 controller = ControlFlow()
 
 
 if __name__ == '__main__':
-    controller.run()
\ No newline at end of file
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--force', nargs='*', choices=ControlFlow.stages, metavar='STAGE',
+        help=f'Re-run the given stages ({", ".join(ControlFlow.stages)}) regardless of the stage cache - every stage if none are given'
+    )
+    parser.add_argument(
+        '--structured', action='store_true',
+        help='Also write JSON lines (log messages and per-stage timing spans) to app/logfiles/events.jsonl'
+    )
+
+    args = parser.parse_args()
+    CustomLogger.structured = args.structured
+
+    controller.run(force=args.force)